@@ -0,0 +1,277 @@
+"""
+Офлайн-бенчмарк бота на подделках Sheets, Drive и Telegram (fakes.py).
+
+Сценарии:
+  rental     - update_reports (выдача байка) и перенос журнала в "Отчёты"
+  extension  - update_reports_extend (продление) и перенос журнала
+  photo      - сжатие и загрузка фото договора
+  video      - получение последнего видео байка
+  webhook    - POST синтетических апдейтов в приложение bot.main()
+
+Для каждого сценария считаются операции в секунду, p50/p99 задержки и
+число вызовов API на операцию. Результат сохраняется в JSON, чтобы
+сравнивать замеры до и после оптимизаций:
+
+    python bench.py --scenarios rental,webhook --ops 500 --latency-ms 80 --error-rate 0.02
+
+С LEDGER_SYNC_INTERVAL=0 каждая выдача сразу пишется в таблицу, как до
+журнала выдач, - так сравниваются замеры с ранними версиями.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# Настройки окружения должны быть заданы до импорта модулей бота
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bot-bench-"))
+
+import fakes  # noqa: E402
+
+SCENARIOS = ("rental", "extension", "photo", "video", "webhook")
+REPORT_HEADERS = ["Дата", "Сумма выдачи", "Количество выдач", "Сумма за месяц в кассе", "Количество выдач за месяц"]
+BIKE_HEADERS = ["ID", "Марка", "Модель", "Гос номер", "Статус"]
+VIDEO_BIKES = 10
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--ops", type=int, default=200, help="операций на сценарий")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=50, help="задержка подделок Google")
+    parser.add_argument("--telegram-latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--real-quota", action="store_true", help="не снимать лимиты quota.py")
+    parser.add_argument("--backoff-cap", type=float, default=0.2, help="максимальная пауза повтора, с")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="файл для JSON (по умолчанию bench_results/...)")
+    return parser.parse_args(argv)
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))
+    return values[index]
+
+
+def _seed_sheets(injector):
+    today = datetime.now()
+    reports = [REPORT_HEADERS]
+    for days in range(365, 0, -1):
+        day = (today - timedelta(days=days)).strftime("%d.%m.%Y")
+        reports.append([day, "1000", "2", str(days * 1000), str(days * 2)])
+    bikes = [BIKE_HEADERS]
+    brands = ["Honda", "Yamaha", "Suzuki", "SYM"]
+    for i in range(1, 201):
+        bikes.append([str(i), brands[i % len(brands)], f"Model{i % 7}", f"59X{i:04d}",
+                      "в аренде" if i % 3 else "свободен"])
+    return fakes.FakeSpreadsheet({
+        "Отчёты": fakes.FakeWorksheet("Отчёты", reports, injector),
+        "список наших байков": fakes.FakeWorksheet("список наших байков", bikes, injector),
+    }, injector)
+
+
+def _seed_drive(injector, root_id, video_size):
+    fake_drive = fakes.FakeDrive(injector)
+    payload = os.urandom(video_size)
+    for i in range(VIDEO_BIKES):
+        folder_id = fake_drive.add_folder(f"bike-{i}", root_id)
+        fake_drive.add_file(f"bike-{i}.mp4", folder_id, payload)
+    return fake_drive
+
+
+def _make_photo(seed: int) -> bytes:
+    import io
+    from PIL import Image
+
+    rnd = random.Random(seed)
+    img = Image.new("RGB", (3000, 2000), (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    noise = Image.effect_noise((3000, 2000), 64).convert("RGB")
+    img = Image.blend(img, noise, 0.5)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+async def _measure(name, op, ops, concurrency, injector, telegram=None, drain=None):
+    latencies = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+    calls_before = injector.snapshot()
+    tg_before = dict(telegram.calls) if telegram else {}
+
+    async def one(i):
+        nonlocal errors
+        async with sem:
+            started = time.perf_counter()
+            try:
+                ok = await op(i)
+                if ok is False:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(ops)))
+    if drain is not None:
+        # Фоновая обработка: ждём, пока дойдут все ответы
+        await drain()
+    elapsed = time.perf_counter() - started
+
+    calls_after = injector.snapshot()
+    api_calls = {k: calls_after.get(k, 0) - calls_before.get(k, 0) for k in calls_after}
+    api_calls = {k: v for k, v in api_calls.items() if v}
+    if telegram:
+        for method, count in telegram.calls.items():
+            delta = count - tg_before.get(method, 0)
+            if delta:
+                api_calls[f"telegram.{method}"] = delta
+
+    result = {
+        "ops": ops,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "ops_per_sec": round(ops / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "api_calls_total": sum(api_calls.values()),
+        "api_calls_per_op": round(sum(api_calls.values()) / ops, 3) if ops else 0.0,
+        "api_calls": api_calls,
+    }
+    print(f"{name:10s} {result['ops_per_sec']:8.1f} ops/s  p50 {result['p50_ms']:8.1f} ms  "
+          f"p99 {result['p99_ms']:8.1f} ms  {result['api_calls_per_op']:6.2f} calls/op  errors {errors}")
+    return result
+
+
+async def _sync_ledger(attempts=10):
+    """
+    update_reports только пишет в локальный журнал (ledger.py). Чтобы замер
+    включал запись в таблицу, ждём синхронизацию всех накопленных дней.
+    """
+    import google_async
+    from ledger import get_ledger
+
+    journal = get_ledger()
+    for _ in range(attempts):
+        if not journal.pending():
+            return
+        try:
+            await google_async.run("sheets", journal.sync)
+        except Exception as e:
+            print(f"Синхронизация журнала не удалась: {e}")
+
+
+async def _webhook_scenario(args, injector):
+    from aiohttp import ClientSession
+    from aiohttp.test_utils import TestServer
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import bot as bot_module
+
+    telegram = fakes.FakeTelegram(args.telegram_latency_ms)
+    tg_server = TestServer(telegram.app())
+    await tg_server.start_server()
+    bot_module.bot.session.api = TelegramAPIServer.from_base(str(tg_server.make_url("")).rstrip("/"))
+
+    app_server = TestServer(bot_module.main())
+    await app_server.start_server()
+    url = str(app_server.make_url(bot_module.WEBHOOK_PATH))
+    sent_before = len(telegram.sent)
+
+    async def drain(timeout=120):
+        deadline = time.monotonic() + timeout
+        while len(telegram.sent) - sent_before < args.ops and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    try:
+        async with ClientSession() as session:
+            async def op(i):
+                update = fakes.make_update(i + 1, chat_id=1000 + i % 50)
+                async with session.post(url, json=update) as resp:
+                    await resp.read()
+                    return resp.status == 200
+
+            result = await _measure("webhook", op, args.ops, args.concurrency, injector, telegram, drain)
+            result["replies"] = len(telegram.sent) - sent_before
+            return result
+    finally:
+        await app_server.close()
+        await tg_server.close()
+
+
+async def run(args):
+    import quota
+    import drive
+    import photos
+    import google_async
+    from google_clients import get_registry
+
+    if not args.real_quota:
+        quota.configure({key: 10 ** 9 for key in quota.BUDGETS})
+    quota.MAX_BACKOFF = args.backoff_cap
+
+    injector = fakes.FaultInjector(args.latency_ms, error_rate=args.error_rate, seed=args.seed)
+    fake_drive = _seed_drive(injector, drive.ROOT_FOLDER_ID, video_size=2 * 1024 * 1024)
+    get_registry().install(spreadsheet=_seed_sheets(injector), drive_factory=fake_drive.service)
+
+    results = {}
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+    # webhook последним: остановка приложения гасит пулы google_async и photos
+    for name in sorted(scenarios, key=SCENARIOS.index):
+        if name == "rental":
+            results[name] = await _measure(
+                name, lambda i: google_async.update_reports(random.randint(100, 500) * 1000),
+                args.ops, args.concurrency, injector, drain=_sync_ledger)
+        elif name == "extension":
+            results[name] = await _measure(
+                name, lambda i: google_async.update_reports_extend(random.randint(100, 500) * 1000),
+                args.ops, args.concurrency, injector, drain=_sync_ledger)
+        elif name == "photo":
+            photo_set = [_make_photo(i) for i in range(3)]
+
+            async def op(i):
+                files = [(f"contract-{i}-{n}.jpg", data) for n, data in enumerate(photo_set)]
+                return bool(await photos.upload_contract_photos(files, f"contract-{i}"))
+
+            results[name] = await _measure(name, op, args.ops, args.concurrency, injector)
+        elif name == "video":
+            async def op(i):
+                return (await google_async.get_latest_video(f"bike-{i % VIDEO_BIKES}")) is not None
+
+            results[name] = await _measure(name, op, args.ops, args.concurrency, injector)
+        elif name == "webhook":
+            results[name] = await _webhook_scenario(args, injector)
+
+    photos.shutdown()
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "results": results,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    out = args.out or os.path.join("bench_results", f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Локальное зеркало листа "список наших байков".
+
+Лист читается одним get_all_values не чаще раза в BIKES_CACHE_TTL секунд.
+Индексы по id/номеру, марке и статусу пересчитываются только для
+изменившихся строк, поэтому выбор марки, пагинация и поиск байка при
+возврате или продлении не обращаются к Sheets API. Методы чтения отдают
+текущее зеркало и сами его не обновляют: обновление выполняет
+google_async.bikes() в пуле потоков.
+"""
+import os
+import time
+import logging
+import threading
+
+import quota
+import metrics
+from sheets import get_sheet
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = float(os.getenv("BIKES_CACHE_TTL", 60))
+
+# Подстроки заголовков, по которым определяются нужные колонки
+ID_HEADERS = ("id", "№")
+PLATE_HEADERS = ("гос", "номер")
+BRAND_HEADERS = ("марка", "бренд")
+STATUS_HEADERS = ("статус",)
+
+
+def _norm(value) -> str:
+    return str(value).strip().lower()
+
+
+def _find_column(headers, keywords):
+    for i, header in enumerate(headers):
+        header_lower = _norm(header)
+        if any(keyword in header_lower for keyword in keywords):
+            return i
+    return None
+
+
+class BikeCache:
+    def __init__(self, ttl: float = CACHE_TTL, sheet_getter=get_sheet):
+        self._ttl = ttl
+        self._sheet_getter = sheet_getter
+        self._lock = threading.RLock()
+        # Чтение листа идёт без _lock, чтобы читатели не ждали сеть
+        self._refresh_lock = threading.Lock()
+        self._expires_at = 0.0
+        self._headers: list[str] = []
+        self._columns: dict[str, int | None] = {}
+        self._raw: dict[int, list[str]] = {}
+        self._rows: dict[int, dict] = {}
+        self._by_key: dict[str, int] = {}
+        self._by_brand: dict[str, set[int]] = {}
+        self._by_status: dict[str, set[int]] = {}
+        self.stats = {"hits": 0, "refreshes": 0, "rows_changed": 0}
+
+    # --- индексы ---
+
+    def _value(self, raw, name):
+        col = self._columns.get(name)
+        if col is None or len(raw) <= col:
+            return ""
+        return raw[col]
+
+    def _unindex(self, row_number):
+        raw = self._raw.pop(row_number, None)
+        self._rows.pop(row_number, None)
+        if raw is None:
+            return
+        for name in ("id", "plate"):
+            key = _norm(self._value(raw, name))
+            if key and self._by_key.get(key) == row_number:
+                del self._by_key[key]
+        for name, index in (("brand", self._by_brand), ("status", self._by_status)):
+            rows = index.get(_norm(self._value(raw, name)))
+            if rows is not None:
+                rows.discard(row_number)
+                if not rows:
+                    del index[_norm(self._value(raw, name))]
+
+    def _index(self, row_number, raw):
+        self._raw[row_number] = raw
+        row = {
+            header: raw[i] if i < len(raw) else ""
+            for i, header in enumerate(self._headers)
+        }
+        row["_row"] = row_number
+        self._rows[row_number] = row
+        for name in ("id", "plate"):
+            key = _norm(self._value(raw, name))
+            if key:
+                self._by_key[key] = row_number
+        brand = _norm(self._value(raw, "brand"))
+        self._by_brand.setdefault(brand, set()).add(row_number)
+        status = _norm(self._value(raw, "status"))
+        self._by_status.setdefault(status, set()).add(row_number)
+
+    def _reset(self, headers):
+        self._headers = headers
+        self._columns = {
+            "id": _find_column(headers, ID_HEADERS),
+            "plate": _find_column(headers, PLATE_HEADERS),
+            "brand": _find_column(headers, BRAND_HEADERS),
+            "status": _find_column(headers, STATUS_HEADERS),
+        }
+        self._raw.clear()
+        self._rows.clear()
+        self._by_key.clear()
+        self._by_brand.clear()
+        self._by_status.clear()
+        logger.info(f"Колонки списка байков: {self._columns}")
+
+    # --- обновление ---
+
+    @metrics.timed("sheets")
+    def refresh(self, force: bool = False):
+        with self._refresh_lock:
+            if not force and time.monotonic() < self._expires_at:
+                with self._lock:
+                    self.stats["hits"] += 1
+                return
+            all_data = quota.call("sheets", "read", self._sheet_getter().get_all_values)
+            self._apply(all_data)
+
+    def _apply(self, all_data):
+        with self._lock:
+            headers = all_data[0] if all_data else []
+            if headers != self._headers:
+                self._reset(headers)
+
+            changed = 0
+            seen = set()
+            for row_number, raw in enumerate(all_data[1:], start=2):
+                if not any(cell.strip() for cell in raw):
+                    continue
+                seen.add(row_number)
+                if self._raw.get(row_number) != raw:
+                    self._unindex(row_number)
+                    self._index(row_number, raw)
+                    changed += 1
+            for row_number in list(self._raw):
+                if row_number not in seen:
+                    self._unindex(row_number)
+                    changed += 1
+
+            self._expires_at = time.monotonic() + self._ttl
+            self.stats["refreshes"] += 1
+            self.stats["rows_changed"] += changed
+            if changed:
+                logger.info(f"Список байков обновлён, изменено строк: {changed}")
+
+    def invalidate(self):
+        with self._lock:
+            self._expires_at = 0.0
+
+    def update(self, key: str, header: str, value):
+        """Write one cell of a bike row and apply it to the mirror."""
+        self.refresh()
+        # Обновление, прочитавшее лист до нашей записи, иначе вернуло бы старое значение
+        with self._refresh_lock:
+            with self._lock:
+                row_number = self._by_key.get(_norm(key))
+                if row_number is None:
+                    raise KeyError(key)
+                col = self._headers.index(header)
+            quota.call("sheets", "write", self._sheet_getter().update_cell, row_number, col + 1, value)
+            with self._lock:
+                raw = list(self._raw.get(row_number, []))
+                while len(raw) <= col:
+                    raw.append("")
+                raw[col] = str(value)
+                self._unindex(row_number)
+                self._index(row_number, raw)
+
+    # --- чтение ---
+
+    def _sorted(self, row_numbers) -> list[dict]:
+        return [self._rows[n] for n in sorted(row_numbers)]
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            row_number = self._by_key.get(_norm(key))
+            return self._rows.get(row_number) if row_number else None
+
+    def all(self) -> list[dict]:
+        with self._lock:
+            return self._sorted(self._rows)
+
+    def brands(self) -> list[str]:
+        with self._lock:
+            names = {}
+            for row_numbers in self._by_brand.values():
+                for n in row_numbers:
+                    brand = self._value(self._raw[n], "brand").strip()
+                    if brand:
+                        names.setdefault(_norm(brand), brand)
+            return sorted(names.values(), key=_norm)
+
+    def by_brand(self, brand: str, status: str | None = None) -> list[dict]:
+        with self._lock:
+            row_numbers = self._by_brand.get(_norm(brand), set())
+            if status is not None:
+                row_numbers = row_numbers & self._by_status.get(_norm(status), set())
+            return self._sorted(row_numbers)
+
+    def by_status(self, status: str) -> list[dict]:
+        with self._lock:
+            return self._sorted(self._by_status.get(_norm(status), set()))
+
+
+def paginate(items: list, page: int, per_page: int = 10):
+    """Возвращает элементы страницы page (с 0) и общее число страниц."""
+    pages = max(1, (len(items) + per_page - 1) // per_page)
+    page = min(max(page, 0), pages - 1)
+    return items[page * per_page:(page + 1) * per_page], pages
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_bike_cache() -> BikeCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = BikeCache()
+        return _cache
@@ -1,4 +1,8 @@
+import time
+_import_started = time.perf_counter()
+
 import os
+import asyncio
 import logging
 from aiohttp import web
 
@@ -7,11 +11,22 @@ from aiogram.types import Message
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
-from sheets import get_sheet
+import photos
+import metrics
+import workers
+import google_async
+from ledger import get_ledger
+from upload_queue import get_upload_queue
+from update_queue import FAST_ACK, QueuedRequestHandler
+from fsm_storage import create_storage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Время старта: импорт модулей и прогрев клиентов Google (см. /metrics)
+startup_stats = {"import_seconds": time.perf_counter() - _import_started, "warm_seconds": 0.0, "ready": 0}
+logger.info(f"Модули импортированы за {startup_stats['import_seconds']:.2f} с")
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBHOOK_PATH = "/webhook"
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
@@ -25,14 +40,14 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 
-dp = Dispatcher()
+dp = Dispatcher(storage=create_storage())
 router = Router()
 
 @router.message()
 async def test_handler(message: Message):
     try:
         logger.info("Handler started")
-        sheet = get_sheet()
+        sheet = await google_async.get_sheet()
         logger.info("Sheet получен успешно")
         await message.answer("OK")
     except Exception as e:
@@ -42,27 +57,62 @@ async def test_handler(message: Message):
 
 dp.include_router(router)
 
+_background_tasks = set()
+
+async def _warm_clients():
+    started = time.perf_counter()
+    try:
+        timings = await google_async.warm_clients()
+        details = ", ".join(f"{name} {seconds:.2f} с" for name, seconds in timings.items())
+        logger.info(f"Клиенты Google прогреты: {details}")
+    except Exception as e:
+        logger.error(f"Не удалось прогреть клиенты Google: {e}")
+    finally:
+        startup_stats["warm_seconds"] = time.perf_counter() - started
+        startup_stats["ready"] = 1
+        logger.info(f"Готов к работе через {time.perf_counter() - _import_started:.2f} с после старта")
+
 async def on_startup(bot: Bot):
-    await bot.set_webhook(WEBHOOK_URL)
-    logger.info(f"Webhook установлен: {WEBHOOK_URL}")
+    # При нескольких воркерах webhook ставит только лидер
+    if workers.is_leader():
+        await bot.set_webhook(WEBHOOK_URL)
+        logger.info(f"Webhook установлен: {WEBHOOK_URL}")
+    get_upload_queue().start(bot)
+    get_ledger().start()
+    # Токен и листы таблицы открываем до первого пользователя; health до этого отвечает 503
+    _background_tasks.add(asyncio.create_task(_warm_clients()))
+    # Прогрев кэша папок Drive не задерживает старт
+    _background_tasks.add(asyncio.create_task(google_async.warm_folder_cache()))
 
 async def on_shutdown(bot: Bot):
-    await bot.delete_webhook()
+    # Перезапуск одного воркера не должен снимать webhook у остальных
+    if not workers.multi():
+        await bot.delete_webhook()
+    await get_upload_queue().stop()
+    await get_ledger().stop()
+    google_async.shutdown()
+    photos.shutdown()
 
 def main():
     app = web.Application()
 
     async def health(request):
+        if not startup_stats["ready"]:
+            return web.Response(status=503, text="Starting")
         return web.Response(text="OK")
 
     app.router.add_get("/", health)
 
-    SimpleRequestHandler(
+    # WEBHOOK_FAST_ACK=1: ответ Telegram сразу, обработка из очереди по чатам
+    handler_class = QueuedRequestHandler if FAST_ACK else SimpleRequestHandler
+    handler_class(
         dispatcher=dp,
         bot=bot,
     ).register(app, path=WEBHOOK_PATH)
 
     setup_application(app, dp, bot=bot)
+    metrics.setup(app, dp)
+    metrics.register_collector("startup", lambda: startup_stats)
 
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
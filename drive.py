@@ -1,180 +1,383 @@
 import io
-import os
-import json
+import time
 import logging
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-from google.oauth2.service_account import Credentials
+import contextlib
+from google_clients import get_registry
+from folder_cache import FolderCache
+from drive_batch import get_batcher
+import quota
+import metrics
 
 SCOPES = ["https://www.googleapis.com/auth/drive"]
 ROOT_FOLDER_ID = "1o3CTuRogOHSd8CxlqdPOMliUYTn7AGkl"
 CONTRACTS_FOLDER_ID = "1fVh7gqQiOeSOjbW68aTQ6Z-t8pm19634"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+VIDEO_CHUNK_SIZE = 8 * 1024 * 1024  # кратно 256 КБ, как требует resumable upload
+SIMPLE_UPLOAD_MAX = 5 * 1024 * 1024  # файлы меньше грузим одним multipart-запросом
+
+_folder_cache = FolderCache()
 
 def get_drive_service():
-    """Get Google Drive service using service account credentials from environment."""
-    creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-    creds = Credentials.from_service_account_info(
-        creds_dict,
-        scopes=SCOPES
-    )
-    return build("drive", "v3", credentials=creds)
+    """Get the pooled Google Drive service for the current thread."""
+    return get_registry().drive()
 
-def get_latest_video(folder_name):
+def forget_folder(folder_name, parent_id=ROOT_FOLDER_ID):
+    """Drop a cached folder id, e.g. after Drive answered 404 for it."""
+    logging.warning(f"Папка {folder_name} не найдена в Drive, сбрасываем её id в кэше")
+    _folder_cache.forget(parent_id, folder_name)
+
+def _in_folder(folder_name, parent_id, resolve, action, folder_id=None):
+    """
+    Run action(folder_id) against a cached folder id. If the folder was deleted
+    or trashed in Drive (404), forget the cached id and retry once with a fresh one.
+    """
     try:
-        drive = get_drive_service()
-        query = f"name = '{folder_name}' and '{ROOT_FOLDER_ID}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        results = drive.files().list(q=query, fields="files(id)").execute()
-        folders = results.get('files', [])
-        if not folders: 
+        return action(folder_id or resolve())
+    except Exception as e:
+        if quota.error_status(e) != 404:
+            raise
+    forget_folder(folder_name, parent_id)
+    return action(resolve())
+
+@metrics.timed("drive")
+def get_latest_video_meta(folder_name):
+    """Return id, name, modifiedTime and size of the newest file in a bike folder, or None."""
+    drive = get_drive_service()
+
+    def latest(folder_id):
+        if not folder_id:
             return None
-        
-        folder_id = folders[0]['id']
-        
         query = f"'{folder_id}' in parents and trashed = false"
-        results = drive.files().list(
-            q=query, 
-            orderBy="createdTime desc", 
-            pageSize=1, 
-            fields="files(id, name)"
-        ).execute()
-        
-        files = results.get('files', [])
-        if not files: 
+        return quota.call("drive", "read", drive.files().list(
+            q=query,
+            orderBy="createdTime desc",
+            pageSize=1,
+            fields="files(id, name, modifiedTime, size)"
+        ).execute)
+
+    results = _in_folder(
+        folder_name, ROOT_FOLDER_ID,
+        lambda: _folder_cache.lookup(
+            ROOT_FOLDER_ID, folder_name,
+            lambda: _find_folder(drive, folder_name, ROOT_FOLDER_ID)
+        ),
+        latest
+    )
+    files = results.get('files', []) if results else []
+    if not files:
+        return None
+    return files[0]
+
+@metrics.timed("drive")
+def download_file(file_id, fh, chunksize=VIDEO_CHUNK_SIZE):
+    """Download a Drive file into a binary file object chunk by chunk."""
+    from googleapiclient.http import MediaIoBaseDownload
+
+    drive = get_drive_service()
+    request = drive.files().get_media(fileId=file_id)
+    downloader = MediaIoBaseDownload(fh, request, chunksize=chunksize)
+    done = False
+    while done is False:
+        status, done = quota.call("drive", "read", downloader.next_chunk, num_retries=3)
+
+@metrics.timed("drive")
+def get_latest_video(folder_name):
+    """Bytes of the newest video in a bike folder; served from video_cache when unchanged."""
+    from video_cache import get_video_cache
+    try:
+        meta = get_latest_video_meta(folder_name)
+        if not meta:
             return None
-        
-        file_id = files[0]['id']
-        request = drive.files().get_media(fileId=file_id)
-        
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        fh.seek(0)
-        return fh.read()
+        return get_video_cache().read(meta, lambda fh: download_file(meta["id"], fh))
     except Exception as e:
         logging.error(f"Ошибка Drive: {e}")
         return None
 
-def get_or_create_folder(drive, name, parent_id):
-    safe_name = name.replace("'", "\\'").replace('"', '\\"').replace("\\", "\\\\")
-    
-    query = (
-        f"name='{safe_name}' and "
-        f"mimeType='application/vnd.google-apps.folder' and "
-        f"'{parent_id}' in parents and trashed=false"
-    )
-    result = drive.files().list(q=query, fields="files(id)").execute()
+def _file_query(name, parent_id):
+    safe_name = name.replace("\\", "\\\\").replace("'", "\\'")
+    return f"name='{safe_name}' and '{parent_id}' in parents and trashed=false"
+
+def _folder_query(name, parent_id):
+    return f"{_file_query(name, parent_id)} and mimeType='{FOLDER_MIME}'"
+
+def _folder_id(result):
     files = result.get("files", [])
     if files:
         return files[0]["id"]
+    return None
+
+def _find_folder(drive, name, parent_id):
+    # Одновременные поиски из разных потоков уходят одним batch-запросом
+    result = get_batcher().execute(
+        lambda d: d.files().list(q=_folder_query(name, parent_id), fields="files(id)")
+    )
+    return _folder_id(result)
+
+def _create_once(create, find, error=None):
+    """
+    Run a non-idempotent files().create (quota.call retries it only on 429).
+    A 5xx may arrive after Drive has already created the file, so before
+    every retry it is looked up with find(). error is a 5xx the first
+    attempt already got.
+    """
+    attempt = 0
+    while True:
+        if error is not None:
+            if not quota.is_retryable(quota.error_status(error)) or attempt >= quota.MAX_RETRIES:
+                raise error
+            attempt += 1
+            time.sleep(quota.backoff(attempt))
+            found = find()
+            if found:
+                return found
+            logging.warning(f"Drive: создание не подтверждено ({error}), повтор {attempt}")
+        try:
+            return create()
+        except Exception as e:
+            error = e
+
+def _create_folder(drive, name, parent_id, error=None):
+    def create():
+        folder = quota.call("drive", "write", drive.files().create(
+            body={
+                "name": name,
+                "mimeType": FOLDER_MIME,
+                "parents": [parent_id]
+            },
+            fields="id"
+        ).execute, idempotent=False)
+        return folder["id"]
+
+    return _create_once(create, lambda: _find_folder(drive, name, parent_id), error)
 
-    folder = drive.files().create(
-        body={
-            "name": name,
-            "mimeType": "application/vnd.google-apps.folder",
-            "parents": [parent_id]
-        },
-        fields="id"
-    ).execute()
+@metrics.timed("drive")
+def get_or_create_folder(drive, name, parent_id):
+    return _folder_cache.get_or_create(
+        parent_id, name,
+        lambda: _find_folder(drive, name, parent_id),
+        lambda: _create_folder(drive, name, parent_id)
+    )
 
-    return folder["id"]
+@metrics.timed("drive")
+def check_folders_exist(folder_names, parent_id=ROOT_FOLDER_ID) -> dict:
+    """
+    Check several folders at once, e.g. for a bike list screen.
+    Cache misses are looked up in one batch request. Returns name -> folder_id or None.
+    """
+    batcher = get_batcher()
+    found = {}
+    futures = {}
+    for name in folder_names:
+        cached, folder_id = _folder_cache.get(parent_id, name)
+        if cached:
+            found[name] = folder_id
+        else:
+            futures[name] = batcher.submit(
+                lambda d, name=name: d.files().list(q=_folder_query(name, parent_id), fields="files(id)")
+            )
+    for name, future in futures.items():
+        try:
+            folder_id = _folder_id(future.result())
+        except Exception as e:
+            logging.error(f"Ошибка проверки папки {name}: {e}")
+            found[name] = None
+            continue
+        _folder_cache.put(parent_id, name, folder_id)
+        found[name] = folder_id
+    return found
 
-from googleapiclient.http import MediaFileUpload
-import tempfile
-import os
+@metrics.timed("drive")
+def get_or_create_folders(specs) -> list:
+    """
+    Find or create several folders, e.g. a bike folder and a contract folder.
+    specs is a list of (name, parent_id). Lookups and creations each go out
+    as one batch request. Returns folder ids in the same order.
+    """
+    batcher = get_batcher()
+    keys = sorted(set(specs))
+    # Замки берутся в одном порядке, поэтому встречные вызовы не взаимоблокируются
+    with contextlib.ExitStack() as stack:
+        for name, parent_id in keys:
+            stack.enter_context(_folder_cache.key_lock(parent_id, name))
+        ids = {}
+        lookups = {}
+        for name, parent_id in keys:
+            cached, folder_id = _folder_cache.get(parent_id, name)
+            if cached and folder_id:
+                ids[(name, parent_id)] = folder_id
+            else:
+                lookups[(name, parent_id)] = batcher.submit(
+                    lambda d, n=name, p=parent_id: d.files().list(q=_folder_query(n, p), fields="files(id)")
+                )
+        creates = {}
+        for key, future in lookups.items():
+            folder_id = _folder_id(future.result())
+            if folder_id:
+                ids[key] = folder_id
+            else:
+                name, parent_id = key
+                creates[key] = batcher.submit(
+                    lambda d, n=name, p=parent_id: d.files().create(
+                        body={"name": n, "mimeType": FOLDER_MIME, "parents": [p]},
+                        fields="id"
+                    ),
+                    kind="write",
+                    idempotent=False
+                )
+        for key, future in creates.items():
+            try:
+                ids[key] = future.result()["id"]
+            except Exception as e:
+                name, parent_id = key
+                ids[key] = _create_folder(get_drive_service(), name, parent_id, error=e)
+        for (name, parent_id), folder_id in ids.items():
+            _folder_cache.put(parent_id, name, folder_id)
+        return [ids[spec] for spec in specs]
+
+@metrics.timed("drive")
+def warm_folder_cache():
+    """Load all child folders of the root folders into the cache, one paginated query per root."""
+    try:
+        drive = get_drive_service()
+        for parent_id in (ROOT_FOLDER_ID, CONTRACTS_FOLDER_ID):
+            folders = {}
+            page_token = None
+            while True:
+                result = quota.call("drive", "read", drive.files().list(
+                    q=f"'{parent_id}' in parents and mimeType='{FOLDER_MIME}' and trashed=false",
+                    fields="nextPageToken, files(id, name)",
+                    pageSize=1000,
+                    pageToken=page_token
+                ).execute, priority=quota.REPORT)
+                for f in result.get("files", []):
+                    folders.setdefault(f["name"], f["id"])
+                page_token = result.get("nextPageToken")
+                if not page_token:
+                    break
+            _folder_cache.put_many(parent_id, folders)
+            logging.info(f"Кэш папок прогрет: {len(folders)} папок в {parent_id}")
+    except Exception as e:
+        logging.error(f"Ошибка прогрева кэша папок: {e}")
 
+@metrics.timed("drive")
 def upload_video(file_bytes: bytes, filename: str, folder_name: str):
-    tmp_path = None
+    """
+    Upload a video from bytes or a binary file-like object.
+    The source is read chunk by chunk, without a temporary file.
+    For Telegram downloads prefer video_stream.stream_telegram_file.
+    """
     try:
         drive = get_drive_service()
-        folder_id = get_or_create_folder(drive, folder_name, ROOT_FOLDER_ID)
-        
-        # Используем временный файл для больших видео
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp:
-            if isinstance(file_bytes, bytes):
-                tmp.write(file_bytes)
-            else:
-                tmp.write(file_bytes.read())
-            tmp_path = tmp.name
-
-        media = MediaFileUpload(
-            tmp_path,
-            mimetype="video/mp4",
-            resumable=True,
-            chunksize=25 * 1024 * 1024  # Увеличили размер чанка до 25MB
-        )
 
-        request = drive.files().create(
-            body={"name": filename, "parents": [folder_id]},
-            media_body=media,
-            fields="id"
+        from googleapiclient.http import MediaIoBaseUpload
+
+        fh = io.BytesIO(file_bytes) if isinstance(file_bytes, (bytes, bytearray)) else file_bytes
+
+        def upload(folder_id):
+            media = MediaIoBaseUpload(
+                fh,
+                mimetype="video/mp4",
+                resumable=True,
+                chunksize=VIDEO_CHUNK_SIZE
+            )
+            request = drive.files().create(
+                body={"name": filename, "parents": [folder_id]},
+                media_body=media,
+                fields="id"
+            )
+            response = None
+            while response is None:
+                status, response = quota.call(
+                    "drive", "write", request.next_chunk, num_retries=3, priority=quota.UPLOAD
+                )
+                if status:
+                    logging.info(f"Загружено {int(status.progress() * 100)}%")
+
+        # 404 приходит при открытии сессии, до отправки данных
+        _in_folder(
+            folder_name, ROOT_FOLDER_ID,
+            lambda: get_or_create_folder(drive, folder_name, ROOT_FOLDER_ID),
+            upload
         )
-        
-        response = None
-        while response is None:
-            status, response = request.next_chunk()
-            if status:
-                logging.info(f"Загружено {int(status.progress() * 100)}%")
-
-        os.remove(tmp_path)
         return True
 
     except Exception as e:
         logging.error(f"Ошибка загрузки видео: {e}")
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
         return False
 
-def get_or_create_folder_for_bike(folder_name: str) -> str | None:
+@metrics.timed("drive")
+def get_or_create_folder_for_bike(folder_name: str, raise_errors: bool = False) -> str | None:
     """Create or get a folder for a bike in the ROOT_FOLDER_ID directory."""
     try:
         drive = get_drive_service()
         return get_or_create_folder(drive, folder_name, ROOT_FOLDER_ID)
     except Exception as e:
         logging.error(f"Ошибка создания/получения папки для байка: {e}")
+        if raise_errors:
+            raise
         return None
 
+@metrics.timed("drive")
 def check_folder_exists(folder_name: str) -> str | None:
     """Check if a folder exists in ROOT_FOLDER_ID directory. Returns folder_id or None."""
     try:
         drive = get_drive_service()
-        safe_name = folder_name.replace("'", "\\'").replace('"', '\\"').replace("\\", "\\\\")
-        
-        query = (
-            f"name='{safe_name}' and "
-            f"mimeType='application/vnd.google-apps.folder' and "
-            f"'{ROOT_FOLDER_ID}' in parents and trashed=false"
+        return _folder_cache.lookup(
+            ROOT_FOLDER_ID, folder_name,
+            lambda: _find_folder(drive, folder_name, ROOT_FOLDER_ID)
         )
-        result = drive.files().list(q=query, fields="files(id)").execute()
-        files = result.get("files", [])
-        if files:
-            return files[0]["id"]
-        return None
     except Exception as e:
         logging.error(f"Ошибка проверки существования папки: {e}")
         return None
 
-def upload_contract_photo(file_bytes: bytes, filename: str, folder_name: str, folder_id: str | None = None):
+@metrics.timed("drive")
+def get_or_create_contract_folder(folder_name: str) -> str | None:
+    """Create or get a contract folder in the CONTRACTS_FOLDER_ID directory."""
     try:
         drive = get_drive_service()
-        if not folder_id:
-            folder_id = get_or_create_folder(drive, folder_name, CONTRACTS_FOLDER_ID)
-        
-        media = MediaIoBaseUpload(
-            io.BytesIO(file_bytes),
-            mimetype="image/jpeg",
-            resumable=True
-        )
+        return get_or_create_folder(drive, folder_name, CONTRACTS_FOLDER_ID)
+    except Exception as e:
+        logging.error(f"Ошибка создания/получения папки договора: {e}")
+        return None
 
-        drive.files().create(
-            body={"name": filename, "parents": [folder_id]},
-            media_body=media,
-            fields="id"
-        ).execute()
+@metrics.timed("drive")
+def upload_contract_photo(file_bytes: bytes, filename: str, folder_name: str, folder_id: str | None = None,
+                          raise_errors: bool = False):
+    try:
+        drive = get_drive_service()
+
+        from googleapiclient.http import MediaIoBaseUpload
+
+        def upload(folder_id):
+            def create():
+                media = MediaIoBaseUpload(
+                    io.BytesIO(file_bytes),
+                    mimetype="image/jpeg",
+                    resumable=len(file_bytes) > SIMPLE_UPLOAD_MAX
+                )
+                return quota.call("drive", "write", drive.files().create(
+                    body={"name": filename, "parents": [folder_id]},
+                    media_body=media,
+                    fields="id"
+                ).execute, priority=quota.UPLOAD, idempotent=False)
 
-        return folder_id
+            def find():
+                result = quota.call("drive", "read", drive.files().list(
+                    q=_file_query(filename, folder_id), fields="files(id)"
+                ).execute, priority=quota.UPLOAD)
+                return _folder_id(result)
+
+            _create_once(create, find)
+            return folder_id
+
+        return _in_folder(
+            folder_name, CONTRACTS_FOLDER_ID,
+            lambda: get_or_create_folder(drive, folder_name, CONTRACTS_FOLDER_ID),
+            upload,
+            folder_id
+        )
     except Exception as e:
         logging.error(f"Ошибка загрузки фото договора: {e}")
+        if raise_errors:
+            raise
         return None
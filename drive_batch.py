@@ -0,0 +1,157 @@
+"""
+Объединение метаданных-запросов к Drive в batch-запросы.
+
+Запросы, поставленные разными потоками в течение DRIVE_BATCH_WINDOW_MS,
+отправляются одним HTTP-запросом через new_batch_http_request (до 100
+штук), а ответы и ошибки раздаются обратно вызывающим. Подходит только
+для запросов без загрузки файлов: files().list, files().create папок,
+files().get. Запросы, получившие 429/5xx, повторяются с той же задержкой,
+что и quota.call, и уходят в один из следующих batch-запросов; создание
+(idempotent=False) повторяется только после 429.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+import quota
+from google_clients import get_registry
+
+logger = logging.getLogger(__name__)
+
+WINDOW = float(os.getenv("DRIVE_BATCH_WINDOW_MS", 10)) / 1000
+MAX_BATCH = 100  # ограничение Drive API на batch
+
+
+class DriveBatcher:
+    def __init__(self, window: float = WINDOW, service_getter=None):
+        self._window = window
+        self._service_getter = service_getter or (lambda: get_registry().drive())
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "retries": 0}
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="drive-batch", daemon=True)
+                self._thread.start()
+
+    def submit(self, builder, kind: str = "read", idempotent: bool = True) -> Future:
+        """
+        builder(drive) returns an unexecuted HttpRequest; the future gets its response.
+        kind ("read" or "write") selects the quota budget the request is charged to.
+        idempotent=False (files().create) retries only on 429, see quota.is_retryable.
+        """
+        future = Future()
+        self._queue.put((builder, future, kind, 0, idempotent))
+        self._ensure_thread()
+        return future
+
+    def execute(self, builder, kind: str = "read", idempotent: bool = True):
+        """Blocking variant of submit()."""
+        return self.submit(builder, kind, idempotent).result()
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self._window
+        while len(items) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                self._send(items)
+            except Exception as e:
+                for _, future, _, _, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _retry_or_fail(self, item, e: Exception):
+        builder, future, kind, attempt, idempotent = item
+        status = quota.error_status(e)
+        if not quota.is_retryable(status, idempotent) or attempt >= quota.MAX_RETRIES:
+            future.set_exception(e)
+            return
+        if status == 429:
+            quota.get_scheduler().penalize("drive", kind)
+        attempt += 1
+        self.stats["retries"] += 1
+        delay = quota.backoff(attempt)
+        logger.warning(f"drive batch: ответ {status}, повтор {attempt} через {delay:.1f} с")
+        # Поток batch не спит: повтор вернётся в очередь по таймеру
+        timer = threading.Timer(delay, self._queue.put, args=((builder, future, kind, attempt, idempotent),))
+        timer.daemon = True
+        timer.start()
+
+    def _send(self, items):
+        service = self._service_getter()
+        self.stats["requests"] += sum(1 for item in items if item[3] == 0)
+        self.stats["batches"] += 1
+
+        # Каждый запрос внутри batch расходует квоту отдельно
+        for kind in ("read", "write"):
+            n = sum(1 for item in items if item[2] == kind)
+            if n:
+                quota.get_scheduler().acquire("drive", kind, n=n)
+
+        if len(items) == 1:
+            builder, future = items[0][:2]
+            try:
+                response = builder(service).execute()
+            except Exception as e:
+                self._retry_or_fail(items[0], e)
+                return
+            future.set_result(response)
+            return
+
+        pending = {}
+
+        def callback(request_id, response, exception):
+            item = pending.pop(request_id)
+            if exception is not None:
+                self._retry_or_fail(item, exception)
+            else:
+                item[1].set_result(response)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for i, item in enumerate(items):
+            builder, future = item[:2]
+            try:
+                request = builder(service)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            pending[str(i)] = item
+            batch.add(request, request_id=str(i))
+        if pending:
+            try:
+                batch.execute()
+            except Exception as e:
+                # Не прошёл сам batch-запрос - повторяем каждый оставшийся
+                for item in list(pending.values()):
+                    self._retry_or_fail(item, e)
+        logger.debug(f"Drive batch: {len(items)} запросов одним HTTP-вызовом")
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> DriveBatcher:
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = DriveBatcher()
+        return _batcher
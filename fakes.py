@@ -0,0 +1,395 @@
+"""
+Локальные подделки Google Sheets, Google Drive и Telegram Bot API для
+бенчмарков (bench.py).
+
+Подделки повторяют ровно те методы gspread/googleapiclient, которыми
+пользуются sheets.py и drive.py, добавляют настраиваемую задержку и
+с заданной вероятностью отвечают 429. Каждый HTTP-вызов считается в
+FaultInjector.calls, чтобы можно было посчитать вызовы API на операцию.
+"""
+import re
+import json
+import time
+import random
+import itertools
+import threading
+from collections import defaultdict
+
+import httplib2
+from aiohttp import web
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol
+from googleapiclient.errors import HttpError
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+class FaultInjector:
+    def __init__(self, latency_ms: float = 0, jitter: float = 0.2, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def hit(self, api: str, op: str):
+        """Account one round-trip, sleep the configured latency, maybe fail with 429."""
+        with self._lock:
+            self.calls[f"{api}.{op}"] += 1
+            fail = self._random.random() < self.error_rate
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+            if fail:
+                self.errors[f"{api}.{op}"] += 1
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise _rate_limit_error(api)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.calls)
+
+
+class _FakeHTTPResponse:
+    def __init__(self, status_code: int, payload: dict):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+
+def _rate_limit_error(api: str) -> Exception:
+    payload = {"error": {"code": 429, "message": "Quota exceeded (fake)", "status": "RESOURCE_EXHAUSTED"}}
+    if api == "sheets":
+        return APIError(_FakeHTTPResponse(429, payload))
+    return HttpError(httplib2.Response({"status": 429}), json.dumps(payload).encode())
+
+
+def _not_found_error(file_id: str) -> Exception:
+    payload = {"error": {"code": 404, "message": f"File not found: {file_id}.", "status": "NOT_FOUND"}}
+    return HttpError(httplib2.Response({"status": 404}), json.dumps(payload).encode())
+
+
+# --- Sheets ---
+
+class FakeWorksheet:
+    def __init__(self, title: str, rows, injector: FaultInjector):
+        self.title = title
+        self.rows = [list(r) for r in rows]
+        self._injector = injector
+        self._lock = threading.Lock()
+
+    def _trimmed(self, row):
+        row = list(row)
+        while row and row[-1] == "":
+            row.pop()
+        return row
+
+    def _set(self, row: int, col: int, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = str(value)
+
+    def get_all_values(self):
+        self._injector.hit("sheets", "values.get")
+        with self._lock:
+            data = [self._trimmed(r) for r in self.rows]
+        while data and not data[-1]:
+            data.pop()
+        return data
+
+    def batch_get(self, ranges):
+        self._injector.hit("sheets", "values.batchGet")
+        out = []
+        with self._lock:
+            for rng in ranges:
+                first, _, last = rng.partition(":")
+                start, end = int(first), int(last or first)
+                rows = [self._trimmed(self.rows[r - 1]) if r <= len(self.rows) else []
+                        for r in range(start, end + 1)]
+                out.append(rows if any(rows) else [])
+        return out
+
+    def batch_update(self, data, value_input_option=None):
+        self._injector.hit("sheets", "values.batchUpdate")
+        with self._lock:
+            for item in data:
+                row, col = a1_to_rowcol(item["range"].split(":")[0])
+                for i, values in enumerate(item["values"]):
+                    for j, value in enumerate(values):
+                        self._set(row + i, col + j, value)
+
+    def update_cell(self, row: int, col: int, value):
+        self._injector.hit("sheets", "values.update")
+        with self._lock:
+            self._set(row, col, value)
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets: dict, injector: FaultInjector):
+        self._worksheets = worksheets
+        self._injector = injector
+
+    def worksheet(self, title: str):
+        self._injector.hit("sheets", "spreadsheets.get")
+        return self._worksheets[title]
+
+    def values_batch_get(self, ranges, params=None):
+        self._injector.hit("sheets", "values.batchGet")
+        value_ranges = []
+        for rng in ranges:
+            ws = self._worksheets[rng.strip("'")]
+            with ws._lock:
+                values = [ws._trimmed(r) for r in ws.rows]
+            while values and not values[-1]:
+                values.pop()
+            value_ranges.append({"range": rng, "values": values})
+        return {"valueRanges": value_ranges}
+
+
+# --- Drive ---
+
+class _Request:
+    def __init__(self, injector: FaultInjector, op: str, run):
+        self._injector = injector
+        self._op = op
+        self._run = run
+
+    def execute(self, num_retries=0):
+        self._injector.hit("drive", self._op)
+        return self._run()
+
+
+class _UploadStatus:
+    def __init__(self, progress: float):
+        self._progress = progress
+
+    def progress(self):
+        return self._progress
+
+
+class _ResumableRequest:
+    def __init__(self, drive, body: dict, media):
+        self._drive = drive
+        self._body = body
+        self._media = media
+        self._offset = 0
+        self._buffer = bytearray()
+        self._started = False
+
+    def next_chunk(self, num_retries=0):
+        if not self._started:
+            self._drive.injector.hit("drive", "upload.start")
+            self._started = True
+        self._drive.injector.hit("drive", "upload.chunk")
+        size = self._media.size()
+        chunk = self._media.getbytes(self._offset, self._media.chunksize())
+        self._buffer.extend(chunk)
+        self._offset += len(chunk)
+        if chunk and (size is None or self._offset < size):
+            return _UploadStatus(self._offset / size if size else 0.0), None
+        return None, self._drive._add(self._body, bytes(self._buffer))
+
+
+class _MediaHttp:
+    def __init__(self, drive, file_id: str):
+        self._drive = drive
+        self._file_id = file_id
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        self._drive.injector.hit("drive", "files.get_media")
+        content = self._drive.files_by_id[self._file_id]["content"]
+        start, end = 0, len(content) - 1
+        match = re.match(r"bytes=(\d+)-(\d+)", (headers or {}).get("range", ""))
+        if match:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(content) - 1)
+        resp = httplib2.Response({
+            "status": 206,
+            "content-range": f"bytes {start}-{end}/{len(content)}",
+        })
+        return resp, content[start:end + 1]
+
+
+class _MediaRequest:
+    def __init__(self, drive, file_id: str):
+        self.uri = f"fake://drive/{file_id}?alt=media"
+        self.headers = {}
+        self.http = _MediaHttp(drive, file_id)
+
+
+class _Batch:
+    def __init__(self, drive, callback):
+        self._drive = drive
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id=None):
+        self._requests.append((request_id, request))
+
+    def execute(self):
+        self._drive.injector.hit("drive", "batch")
+        for request_id, request in self._requests:
+            try:
+                response = request._run()
+            except Exception as e:
+                self._callback(request_id, None, e)
+            else:
+                self._callback(request_id, response, None)
+
+
+class _Files:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def list(self, q="", fields=None, orderBy=None, pageSize=100, pageToken=None, **kwargs):
+        return _Request(self._drive.injector, "files.list",
+                        lambda: self._drive._list(q, orderBy, pageSize, pageToken))
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        if media_body is not None and media_body.resumable():
+            return _ResumableRequest(self._drive, body, media_body)
+
+        def run():
+            content = media_body.getbytes(0, media_body.size()) if media_body is not None else b""
+            return self._drive._add(body, content)
+        return _Request(self._drive.injector, "files.create", run)
+
+    def get_media(self, fileId=None, **kwargs):
+        return _MediaRequest(self._drive, fileId)
+
+
+class FakeDrive:
+    """Shared in-memory Drive; service() returns a googleapiclient-like resource."""
+
+    def __init__(self, injector: FaultInjector):
+        self.injector = injector
+        self.files_by_id: dict[str, dict] = {}
+        self._ids = itertools.count(1)
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()
+        self.deleted: set[str] = set()
+
+    def service(self):
+        return self
+
+    def files(self):
+        return _Files(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    def _add(self, body: dict, content: bytes = b"") -> dict:
+        with self._lock:
+            for parent_id in body.get("parents", []):
+                if parent_id in self.deleted:
+                    raise _not_found_error(parent_id)
+            file_id = f"fake{next(self._ids)}"
+            stamp = f"2026-01-01T00:00:{next(self._clock):09d}Z"
+            self.files_by_id[file_id] = {
+                "id": file_id,
+                "name": body["name"],
+                "mimeType": body.get("mimeType", "application/octet-stream"),
+                "parents": list(body.get("parents", [])),
+                "createdTime": stamp,
+                "modifiedTime": stamp,
+                "size": str(len(content)),
+                "content": content,
+            }
+        return {"id": file_id}
+
+    def add_folder(self, name: str, parent_id: str) -> str:
+        return self._add({"name": name, "mimeType": FOLDER_MIME, "parents": [parent_id]})["id"]
+
+    def add_file(self, name: str, parent_id: str, content: bytes) -> str:
+        return self._add({"name": name, "parents": [parent_id]}, content)["id"]
+
+    def delete(self, file_id: str):
+        """Remove a file or folder; later requests against its id get 404."""
+        with self._lock:
+            self.files_by_id.pop(file_id, None)
+            self.deleted.add(file_id)
+
+    def _list(self, q: str, order_by, page_size: int, page_token):
+        name = re.search(r"name\s*=\s*'((?:\\.|[^'\\])*)'", q)
+        mime = re.search(r"mimeType\s*=\s*'([^']+)'", q)
+        parent = re.search(r"'([^']+)'\s+in\s+parents", q)
+        if parent and parent.group(1) in self.deleted:
+            raise _not_found_error(parent.group(1))
+        with self._lock:
+            files = list(self.files_by_id.values())
+        if name:
+            wanted = re.sub(r"\\(.)", r"\1", name.group(1))
+            files = [f for f in files if f["name"] == wanted]
+        if mime:
+            files = [f for f in files if f["mimeType"] == mime.group(1)]
+        if parent:
+            files = [f for f in files if parent.group(1) in f["parents"]]
+        if order_by and order_by.startswith("createdTime"):
+            files.sort(key=lambda f: f["createdTime"], reverse=order_by.endswith("desc"))
+        start = int(page_token or 0)
+        page = files[start:start + page_size]
+        result = {"files": [{k: v for k, v in f.items() if k != "content"} for f in page]}
+        if start + page_size < len(files):
+            result["nextPageToken"] = str(start + page_size)
+        return result
+
+
+# --- Telegram ---
+
+class FakeTelegram:
+    """Minimal Bot API server: answers every method and records sent messages."""
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.calls = defaultdict(int)
+        self.sent: list[tuple[float, int]] = []
+        self._message_ids = itertools.count(1)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    async def _handle(self, request):
+        import asyncio
+
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method in ("sendMessage", "editMessageText", "sendVideo"):
+            data = await request.post()
+            chat_id = int(data.get("chat_id", 0))
+            self.sent.append((time.monotonic(), chat_id))
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            }
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def make_update(update_id: int, chat_id: int, text: str = "/start") -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }
@@ -0,0 +1,185 @@
+"""
+Кэш id папок Google Drive по ключу (parent_id, name).
+
+Найденные папки запоминаются и сохраняются на диск, промахи - на
+NEGATIVE_TTL секунд. Если папку удалили в Drive и запрос с её id вернул
+404, drive.py забывает id (forget) и повторяет запрос один раз.
+
+Поиск с созданием выполняется под замком на ключ, поэтому одновременные
+первые загрузки для одного байка не создают две одинаковые папки. При
+нескольких воркерах gunicorn к замку потока добавляется файловая
+блокировка DATA_DIR/folder_locks/<ключ>.lock: задачи загрузки из общей
+очереди выполняет любой воркер. Взяв её, воркер перечитывает folders.json
+и видит папки, которые другой воркер только что создал. Файл кэша
+дописывается под своей блокировкой, чтобы воркеры не затирали записи
+друг друга.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import workers
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", ".data")
+CACHE_PATH = os.path.join(DATA_DIR, "folders.json")
+LOCKS_DIR = os.path.join(DATA_DIR, "folder_locks")
+NEGATIVE_TTL = float(os.getenv("FOLDER_NEGATIVE_TTL", 30))
+
+
+class _KeyLock:
+    """Thread lock of one key plus, in multi-worker mode, a file lock shared by all workers."""
+
+    def __init__(self, lock: threading.Lock, path: str | None, on_acquire=None):
+        self._lock = lock
+        self._path = path
+        self._on_acquire = on_acquire
+        self._file_lock = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._path:
+            try:
+                self._file_lock = workers.FileLock(self._path).__enter__()
+                if self._on_acquire is not None:
+                    self._on_acquire()
+            except BaseException:
+                if self._file_lock is not None:
+                    self._file_lock.__exit__(None, None, None)
+                    self._file_lock = None
+                self._lock.release()
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        if self._file_lock is not None:
+            self._file_lock.__exit__(*exc)
+            self._file_lock = None
+        self._lock.release()
+
+
+class FolderCache:
+    def __init__(self, path: str | None = CACHE_PATH, negative_ttl: float = NEGATIVE_TTL):
+        self._path = path
+        self._negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._key_locks: dict[tuple, threading.Lock] = {}
+        self._ids: dict[tuple, str] = {}
+        self._misses: dict[tuple, float] = {}
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0}
+        self._load()
+
+    def _read(self) -> dict[tuple, str]:
+        if not self._path or not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                return {(parent_id, name): folder_id for parent_id, name, folder_id in json.load(f)}
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Кэш папок повреждён, начинаем с пустого: {e}")
+            return {}
+
+    def _load(self):
+        self._ids.update(self._read())
+
+    def reload(self):
+        """Merge entries that other workers saved to the shared file."""
+        ids = self._read()
+        with self._lock:
+            for key, folder_id in ids.items():
+                self._ids[key] = folder_id
+                self._misses.pop(key, None)
+
+    def _save(self, changes: dict[tuple, str | None]):
+        """Apply changes to the shared file (None removes a key), keeping other workers' entries."""
+        if not self._path:
+            return
+        with workers.FileLock(f"{self._path}.lock"):
+            ids = self._read()
+            for key, folder_id in changes.items():
+                if folder_id is None:
+                    ids.pop(key, None)
+                else:
+                    ids[key] = folder_id
+            tmp_path = f"{self._path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([[p, n, i] for (p, n), i in ids.items()], f, ensure_ascii=False)
+            os.replace(tmp_path, self._path)
+        self._ids.update(ids)
+
+    def key_lock(self, parent_id: str, name: str) -> _KeyLock:
+        with self._lock:
+            lock = self._key_locks.setdefault((parent_id, name), threading.Lock())
+        if not workers.multi():
+            return _KeyLock(lock, None)
+        digest = hashlib.sha1(f"{parent_id}/{name}".encode("utf-8")).hexdigest()
+        return _KeyLock(lock, os.path.join(LOCKS_DIR, f"{digest}.lock"), self.reload)
+
+    def get(self, parent_id: str, name: str):
+        """Return (found, folder_id); found is False when Drive must be asked."""
+        key = (parent_id, name)
+        with self._lock:
+            if key in self._ids:
+                self.stats["hits"] += 1
+                return True, self._ids[key]
+            expires = self._misses.get(key)
+            if expires is not None and expires > time.monotonic():
+                self.stats["negative_hits"] += 1
+                return True, None
+            self.stats["misses"] += 1
+            return False, None
+
+    def put(self, parent_id: str, name: str, folder_id: str | None):
+        key = (parent_id, name)
+        with self._lock:
+            if folder_id is None:
+                self._misses[key] = time.monotonic() + self._negative_ttl
+                return
+            self._misses.pop(key, None)
+            if self._ids.get(key) != folder_id:
+                self._ids[key] = folder_id
+                self._save({key: folder_id})
+
+    def put_many(self, parent_id: str, folders: dict[str, str]):
+        with self._lock:
+            for name, folder_id in folders.items():
+                self._ids[(parent_id, name)] = folder_id
+                self._misses.pop((parent_id, name), None)
+            self._save({(parent_id, name): folder_id for name, folder_id in folders.items()})
+
+    def forget(self, parent_id: str, name: str):
+        with self._lock:
+            self._misses.pop((parent_id, name), None)
+            self._ids.pop((parent_id, name), None)
+            # Запись могла появиться в файле от другого воркера - удаляем и там
+            self._save({(parent_id, name): None})
+
+    def lookup(self, parent_id: str, name: str, finder):
+        """Cached find: finder() is called on a miss and may return None."""
+        found, folder_id = self.get(parent_id, name)
+        if found:
+            return folder_id
+        with self.key_lock(parent_id, name):
+            found, folder_id = self.get(parent_id, name)
+            if found:
+                return folder_id
+            folder_id = finder()
+            self.put(parent_id, name, folder_id)
+            return folder_id
+
+    def get_or_create(self, parent_id: str, name: str, finder, creator):
+        """Cached find-or-create, serialized per (parent_id, name)."""
+        with self.key_lock(parent_id, name):
+            found, folder_id = self.get(parent_id, name)
+            if found and folder_id:
+                return folder_id
+            # Отрицательный кэш здесь не доверяем: папку могли создать только что
+            folder_id = finder()
+            if not folder_id:
+                folder_id = creator()
+            self.put(parent_id, name, folder_id)
+            return folder_id
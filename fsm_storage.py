@@ -0,0 +1,192 @@
+"""
+Постоянное хранилище FSM.
+
+Состояния и данные диалогов (тип залога, контакт, фото договора, выбор
+байка для возврата/продления) переживают перезапуск и видны всем
+экземплярам приложения:
+
+- по умолчанию - SQLite в режиме WAL (DATA_DIR/fsm.sqlite3), подходит
+  для нескольких процессов на одной машине. Файл переживает перезапуск,
+  но не передеплой, если DATA_DIR не на подключённом томе: на Railway
+  нужно смонтировать volume и указать его путь в DATA_DIR;
+- если задан FSM_REDIS_URL - Redis через aiogram RedisStorage
+  (нужен пакет redis), подходит для нескольких машин.
+
+Поверх хранилища стоит кэш в памяти со сквозной записью: запись сразу
+уходит в хранилище, чтение в течение FSM_CACHE_TTL секунд берётся из
+памяти. Кэш не знает о записях других экземпляров, поэтому с Redis
+(реплики без маршрутизации чатов) он по умолчанию выключен
+(FSM_CACHE_TTL=0). Для SQLite апдейты чата обрабатывает один воркер
+(workers.py), и кэш по умолчанию держится 2 секунды.
+"""
+import os
+import copy
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", ".data")
+DB_PATH = os.path.join(DATA_DIR, "fsm.sqlite3")
+REDIS_URL = os.getenv("FSM_REDIS_URL")
+CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", 0 if REDIS_URL else 2))
+CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+def _state(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """Запросы выполняются в потоке: при записи из нескольких процессов они ждут блокировку файла."""
+
+    def __init__(self, path: str = DB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # Файл могут делить несколько процессов
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(_SCHEMA)
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()
+
+    async def _run(self, sql: str, params=()):
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._run(
+            "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (_key(key), _state(state), time.time())
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._run("SELECT state FROM fsm WHERE key = ?", (_key(key),))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(
+            "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (_key(key), json.dumps(data, ensure_ascii=False), time.time())
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._run("SELECT data FROM fsm WHERE key = ?", (_key(key),))
+        return json.loads(row[0]) if row else {}
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._close)
+
+    def _close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedStorage(BaseStorage):
+    """Write-through LRU cache in front of another storage."""
+
+    def __init__(self, storage: BaseStorage, ttl: float = CACHE_TTL, max_size: int = CACHE_SIZE):
+        self.storage = storage
+        self._ttl = ttl
+        self._max_size = max_size
+        self._states: OrderedDict = OrderedDict()
+        self._data: OrderedDict = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+
+    def _get(self, cache: OrderedDict, key: StorageKey):
+        entry = cache.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self.stats["misses"] += 1
+            return False, None
+        cache.move_to_end(key)
+        self.stats["hits"] += 1
+        return True, entry[0]
+
+    def _put(self, cache: OrderedDict, key: StorageKey, value):
+        if self._ttl <= 0:
+            return
+        cache[key] = (value, time.monotonic() + self._ttl)
+        cache.move_to_end(key)
+        while len(cache) > self._max_size:
+            cache.popitem(last=False)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._states.pop(key, None)
+        await self.storage.set_state(key, state)
+        self.stats["writes"] += 1
+        self._put(self._states, key, _state(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        found, state = self._get(self._states, key)
+        if not found:
+            state = await self.storage.get_state(key)
+            self._put(self._states, key, state)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._data.pop(key, None)
+        await self.storage.set_data(key, data)
+        self.stats["writes"] += 1
+        self._put(self._data, key, copy.deepcopy(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        found, data = self._get(self._data, key)
+        if not found:
+            data = await self.storage.get_data(key)
+            self._put(self._data, key, copy.deepcopy(data))
+        # Обработчик может менять словарь, кэш отдаёт копию
+        return copy.deepcopy(data)
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, cached=len(self._states) + len(self._data))
+
+    async def close(self) -> None:
+        self._states.clear()
+        self._data.clear()
+        await self.storage.close()
+
+
+def create_storage() -> CachedStorage:
+    """Storage for Dispatcher: Redis if FSM_REDIS_URL is set, SQLite otherwise."""
+    if REDIS_URL:
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            raise RuntimeError("Для FSM_REDIS_URL нужен пакет redis: pip install redis")
+        backend = RedisStorage.from_url(REDIS_URL)
+        logger.info("FSM: хранилище Redis")
+    else:
+        backend = SQLiteStorage()
+        logger.info(f"FSM: хранилище SQLite {DB_PATH}")
+        if "DATA_DIR" not in os.environ:
+            logger.warning("FSM: DATA_DIR не задан, состояния диалогов пропадут при передеплое - "
+                           "подключите постоянный том и укажите его путь в DATA_DIR")
+    logger.info(f"FSM: кэш чтения {CACHE_TTL:g} с")
+    return CachedStorage(backend)
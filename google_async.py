@@ -0,0 +1,109 @@
+"""
+Асинхронный фасад над sheets.py и drive.py.
+
+Синхронные вызовы Google API выполняются в ограниченном пуле потоков,
+поэтому event loop aiohttp не блокируется. У каждого API свой лимит
+одновременных вызовов: медленная загрузка видео занимает только слот
+"drive_upload" и не мешает чтению таблиц для остальных пользователей.
+"""
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import sheets
+import drive
+
+LIMITS = {
+    "sheets": int(os.getenv("SHEETS_CONCURRENCY", 4)),
+    "drive": int(os.getenv("DRIVE_CONCURRENCY", 4)),
+    "drive_upload": int(os.getenv("DRIVE_UPLOAD_CONCURRENCY", 2)),
+}
+
+# Пул рассчитан на сумму лимитов, чтобы ни один API не ждал свободный поток
+_executor = ThreadPoolExecutor(
+    max_workers=sum(LIMITS.values()),
+    thread_name_prefix="google"
+)
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def _semaphore(api: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(api)
+    if sem is None:
+        sem = asyncio.Semaphore(LIMITS[api])
+        _semaphores[api] = sem
+    return sem
+
+
+async def run(api: str, func, *args, **kwargs):
+    """Run a blocking Google call in the pool under the ``api`` limit."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    async with _semaphore(api):
+        return await loop.run_in_executor(_executor, call)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Sheets ---
+
+async def get_sheet():
+    return await run("sheets", sheets.get_sheet)
+
+async def get_reports_sheet():
+    return await run("sheets", sheets.get_reports_sheet)
+
+async def update_reports(rental_sum):
+    return await run("sheets", sheets.update_reports, rental_sum)
+
+async def update_reports_extend(rental_sum):
+    return await run("sheets", sheets.update_reports_extend, rental_sum)
+
+
+# --- Drive ---
+
+async def get_latest_video(folder_name):
+    return await run("drive_upload", drive.get_latest_video, folder_name)
+
+async def get_or_create_folder_for_bike(folder_name: str, raise_errors: bool = False):
+    return await run("drive", drive.get_or_create_folder_for_bike, folder_name, raise_errors)
+
+async def check_folder_exists(folder_name: str):
+    return await run("drive", drive.check_folder_exists, folder_name)
+
+async def check_folders_exist(folder_names):
+    return await run("drive", drive.check_folders_exist, folder_names)
+
+async def get_or_create_folders(specs):
+    return await run("drive", drive.get_or_create_folders, specs)
+
+async def upload_video(file_bytes, filename: str, folder_name: str):
+    return await run("drive_upload", drive.upload_video, file_bytes, filename, folder_name)
+
+async def upload_contract_photo(file_bytes: bytes, filename: str, folder_name: str, folder_id: str | None = None,
+                                raise_errors: bool = False):
+    return await run("drive_upload", drive.upload_contract_photo, file_bytes, filename, folder_name, folder_id,
+                     raise_errors)
+
+async def warm_folder_cache():
+    return await run("drive", drive.warm_folder_cache)
+
+async def warm_clients():
+    """Open the spreadsheet and worksheet handles (and fetch the token) before the first user."""
+    from google_clients import get_registry
+    return await run("sheets", get_registry().warm, (sheets.BIKES_WORKSHEET, sheets.REPORTS_WORKSHEET))
+
+
+# --- Кэш списка байков ---
+
+async def bikes():
+    """Return the bike mirror, refreshing it in the pool if the TTL expired."""
+    from bike_cache import get_bike_cache
+    cache = get_bike_cache()
+    await run("sheets", cache.refresh)
+    return cache
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import logging
+import threading
+import functools
+
+import quota
+
+logger = logging.getLogger(__name__)
+
+# Объединённые скоупы для Sheets и Drive - один набор учётных данных на процесс
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+SPREADSHEET_ID = "1xrCL9RBJHfNQGETgLLvnQtrSErNhQPeYkaXVSKkjSQo"
+
+
+# gspread и googleapiclient импортируются при первом обращении, а не при
+# импорте модуля: так быстрее старт процесса.
+
+@functools.lru_cache(maxsize=None)
+def _credentials_class():
+    from google.oauth2.service_account import Credentials
+
+    class _CountingCredentials(Credentials):
+        """Service account credentials that count token refreshes."""
+
+        def refresh(self, request):
+            super().refresh(request)
+            with _registry._stats_lock:
+                _registry.stats["token_refreshes"] += 1
+            logger.info("Токен Google обновлён")
+
+    return _CountingCredentials
+
+
+@functools.lru_cache(maxsize=None)
+def _drive_document() -> dict:
+    """Drive v3 discovery document bundled with googleapiclient, parsed once per process."""
+    from googleapiclient import discovery_cache
+
+    return json.loads(discovery_cache.get_static_doc("drive", "v3"))
+
+
+class ClientRegistry:
+    """Process-wide pool of Google clients.
+
+    Credentials, the gspread client, the opened spreadsheet and worksheet
+    handles are built once and shared. The Drive resource is kept per thread
+    because httplib2 connections are not thread-safe. Tokens are refreshed
+    automatically by the authorized transports on expiry.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Открытие таблицы и листов - сетевые вызовы с повторами quota.call,
+        # у каждого свой замок, чтобы drive() и другие листы их не ждали
+        self._open_lock = threading.Lock()
+        self._worksheet_locks: dict[str, threading.Lock] = {}
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self._creds = None
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._drive_factory = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "token_refreshes": 0,
+        }
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            self.stats["hits" if hit else "misses"] += 1
+
+    def credentials(self):
+        with self._lock:
+            if self._creds is None:
+                creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
+                self._creds = _credentials_class().from_service_account_info(
+                    creds_dict,
+                    scopes=SCOPES
+                )
+            return self._creds
+
+    def gspread_client(self):
+        with self._lock:
+            self._count(self._client is not None)
+            if self._client is None:
+                import gspread
+
+                self._client = gspread.authorize(self.credentials())
+            return self._client
+
+    def spreadsheet(self):
+        spreadsheet = self._spreadsheet
+        self._count(spreadsheet is not None)
+        if spreadsheet is not None:
+            return spreadsheet
+        with self._open_lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = quota.call("sheets", "read", self.gspread_client().open_by_key, SPREADSHEET_ID)
+            return self._spreadsheet
+
+    def worksheet(self, title: str):
+        ws = self._worksheets.get(title)
+        self._count(ws is not None)
+        if ws is not None:
+            return ws
+        with self._lock:
+            lock = self._worksheet_locks.setdefault(title, threading.Lock())
+        with lock:
+            ws = self._worksheets.get(title)
+            if ws is None:
+                ws = quota.call("sheets", "read", self.spreadsheet().worksheet, title)
+                self._worksheets[title] = ws
+            return ws
+
+    def drive(self):
+        service = getattr(self._local, "drive", None)
+        self._count(service is not None)
+        if service is None:
+            if self._drive_factory is not None:
+                service = self._drive_factory()
+            else:
+                from googleapiclient.discovery import build_from_document
+
+                # Без запроса discovery и повторного разбора JSON в каждом потоке
+                service = build_from_document(_drive_document(), credentials=self.credentials())
+            self._local.drive = service
+        return service
+
+    def warm(self, worksheets=()) -> dict:
+        """
+        Open the spreadsheet and worksheets ahead of the first user, which
+        also fetches the access token. Returns seconds spent per step.
+        """
+        timings = {}
+        started = time.perf_counter()
+        _drive_document()
+        timings["drive_discovery"] = time.perf_counter() - started
+        started = time.perf_counter()
+        self.spreadsheet()
+        timings["spreadsheet"] = time.perf_counter() - started
+        for title in worksheets:
+            started = time.perf_counter()
+            self.worksheet(title)
+            timings[f"worksheet:{title}"] = time.perf_counter() - started
+        return timings
+
+    def install(self, spreadsheet=None, drive_factory=None):
+        """Use ready-made clients instead of Google, e.g. the fakes in fakes.py."""
+        self.reset()
+        with self._lock:
+            self._spreadsheet = spreadsheet
+            self._drive_factory = drive_factory
+
+    def reset(self):
+        """Drop every pooled handle, e.g. after the worksheet was renamed."""
+        with self._lock:
+            self._client = None
+            self._spreadsheet = None
+            self._worksheets.clear()
+            self._local = threading.local()
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats)
+
+
+_registry = ClientRegistry()
+
+
+def get_registry() -> ClientRegistry:
+    return _registry
@@ -0,0 +1,19 @@
+"""
+Запуск в несколько процессов:
+
+    gunicorn "bot:main()"
+
+Число воркеров - WEB_CONCURRENCY, по умолчанию 2: бот упирается в квоты
+Google, а не в процессор, и лишние процессы только делят общий бюджет.
+Разделение работы между воркерами описано в workers.py.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8080)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = "aiohttp.GunicornWebWorker"
+timeout = 120
+graceful_timeout = 30
+
+# Воркеры узнают общее число процессов из окружения (workers.py, quota.py)
+os.environ["BOT_WORKERS"] = str(workers)
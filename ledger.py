@@ -0,0 +1,301 @@
+"""
+Локальный журнал выдач и продлений.
+
+Каждая выдача и продление сразу записываются в SQLite
+(DATA_DIR/ledger.sqlite3) одной транзакцией вместе с дневными итогами.
+Обработчик не ждёт Google и не теряет сумму, если таблица недоступна.
+Фоновая задача раз в LEDGER_SYNC_INTERVAL секунд переносит в "Отчёты"
+ещё не записанные приращения по дням; LEDGER_SYNC_INTERVAL=0 пишет в
+таблицу сразу, как раньше. Итоги за любой период считаются из дневной
+таблицы без обращения к Google.
+
+Перед записью строки в журнале сохраняются её ожидаемые итоги. Если
+запись дошла до Google, но ответ потерян (таймаут, падение процесса),
+следующая синхронизация увидит эти итоги в строке и не добавит
+приращение второй раз.
+
+Журнал должен лежать на постоянном томе (DATA_DIR). Без DATA_DIR ещё не
+записанные в таблицу выдачи пропали бы при передеплое, поэтому по
+умолчанию тогда используется синхронная запись.
+"""
+import os
+import glob
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from datetime import date, datetime
+
+from workers import FileLock
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", ".data")
+DB_PATH = os.path.join(DATA_DIR, "ledger.sqlite3")
+# Чтение-изменение-запись строки отчёта нельзя делать из двух процессов сразу
+LOCK_PATH = os.path.join(DATA_DIR, "reports.lock")
+# Без постоянного тома откладывать запись в таблицу нельзя
+SYNC_INTERVAL = float(os.getenv("LEDGER_SYNC_INTERVAL", 30 if "DATA_DIR" in os.environ else 0))
+
+KIND_RENTAL = "rental"
+KIND_EXTENSION = "extension"
+KIND_JOURNAL = "journal"  # перенесено из журнала report_counters
+
+SHEET_DATE = "%d.%m.%Y"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_day ON transactions (day);
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT PRIMARY KEY,
+    sum INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    synced_sum INTEGER NOT NULL DEFAULT 0,
+    synced_count INTEGER NOT NULL DEFAULT 0,
+    inflight_sum INTEGER,
+    inflight_count INTEGER,
+    target_sum INTEGER,
+    target_count INTEGER
+);
+"""
+# Колонки, добавленные после первой версии схемы
+_MIGRATIONS = {
+    "inflight_sum": "ALTER TABLE daily ADD COLUMN inflight_sum INTEGER",
+    "inflight_count": "ALTER TABLE daily ADD COLUMN inflight_count INTEGER",
+    "target_sum": "ALTER TABLE daily ADD COLUMN target_sum INTEGER",
+    "target_count": "ALTER TABLE daily ADD COLUMN target_count INTEGER",
+}
+
+
+class Ledger:
+    def __init__(self, writer, path: str = DB_PATH, lock_path: str = LOCK_PATH):
+        """
+        writer(date_str, rental_sum, rental_count, expected, before_write)
+        добавляет приращение в строку отчёта за день дд.мм.гггг и бросает
+        исключение при ошибке. Если в строке уже стоят итоги expected
+        (sum, count), writer ничего не пишет. Иначе перед записью он
+        вызывает before_write(sum, count) с итогами, которые запишет.
+        """
+        self._writer = writer
+        self._lock_path = lock_path
+        self._lock = threading.Lock()
+        self._task = None
+        self.stats = {"recorded": 0, "synced_days": 0, "sync_errors": 0, "last_sync": 0.0}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(daily)")}
+        for column, sql in _MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(sql)
+        self._import_journals()
+
+    # --- запись ---
+
+    def _insert(self, kind: str, amount: int, count: int, day: str, created_at: float) -> int:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = self._db.execute(
+                "INSERT INTO transactions (created_at, day, kind, amount, count) VALUES (?, ?, ?, ?, ?)",
+                (created_at, day, kind, amount, count)
+            )
+            self._db.execute(
+                "INSERT INTO daily (day, sum, count) VALUES (?, ?, ?)"
+                " ON CONFLICT (day) DO UPDATE SET sum = sum + excluded.sum, count = count + excluded.count",
+                (day, amount, count)
+            )
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        return cur.lastrowid
+
+    def record(self, kind: str, amount: int, count: int, when: datetime | None = None) -> int:
+        """Append a rental/extension and update its day totals atomically. Returns the row id."""
+        when = when or datetime.now()
+        with self._lock:
+            row_id = self._insert(kind, int(amount), int(count), when.date().isoformat(), when.timestamp())
+            self.stats["recorded"] += 1
+        return row_id
+
+    def _import_journals(self):
+        """Move increments left in the old report_counters journals into the ledger."""
+        paths = glob.glob(os.path.join(DATA_DIR, "reports_journal*.jsonl"))
+        if not paths:
+            return
+        # Воркеры стартуют одновременно: переносит тот, кто первым взял блокировку
+        with FileLock(self._lock_path):
+            for path in paths:
+                if not os.path.exists(path):
+                    continue
+                imported = 0
+                with self._lock, open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        day = datetime.strptime(entry["date"], SHEET_DATE).date().isoformat()
+                        self._insert(KIND_JOURNAL, entry["sum"], entry["count"], day, time.time())
+                        imported += 1
+                os.remove(path)
+                if imported:
+                    logger.info(f"Перенесено в журнал выдач из {path}: {imported} приращений")
+
+    # --- синхронизация с таблицей ---
+
+    def pending(self) -> list[tuple[str, int, int]]:
+        """(day, sum, count) not yet written to the sheet, oldest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT day, sum - synced_sum, count - synced_count FROM daily"
+                " WHERE sum != synced_sum OR count != synced_count ORDER BY day"
+            ).fetchall()
+
+    def _outgoing(self) -> list[tuple]:
+        """
+        (day, sum, count, expected) to write, oldest first. A day with an
+        unconfirmed write resends the same delta with its expected totals.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT day, sum - synced_sum, count - synced_count, inflight_sum, inflight_count,"
+                " target_sum, target_count FROM daily"
+                " WHERE sum != synced_sum OR count != synced_count OR inflight_sum IS NOT NULL ORDER BY day"
+            ).fetchall()
+        result = []
+        for day, day_sum, day_count, inflight_sum, inflight_count, target_sum, target_count in rows:
+            if inflight_sum is None:
+                result.append((day, day_sum, day_count, None))
+            else:
+                result.append((day, inflight_sum, inflight_count, (target_sum, target_count)))
+        return result
+
+    def _set_inflight(self, day: str, day_sum: int, day_count: int, target_sum: int, target_count: int):
+        # Сохраняется до записи в таблицу: после сбоя будет видно, дошла ли она
+        with self._lock:
+            self._db.execute(
+                "UPDATE daily SET inflight_sum = ?, inflight_count = ?, target_sum = ?, target_count = ?"
+                " WHERE day = ?",
+                (day_sum, day_count, target_sum, target_count, day)
+            )
+
+    def sync(self) -> int:
+        """Write pending day deltas to the sheet. Returns the number of days written."""
+        synced = 0
+        # Под общей блокировкой: другой воркер не запишет те же приращения
+        with FileLock(self._lock_path):
+            for day, day_sum, day_count, expected in self._outgoing():
+                sheet_day = date.fromisoformat(day).strftime(SHEET_DATE)
+
+                def before_write(target_sum, target_count, day=day, day_sum=day_sum, day_count=day_count):
+                    self._set_inflight(day, day_sum, day_count, target_sum, target_count)
+
+                try:
+                    self._writer(sheet_day, day_sum, day_count, expected, before_write)
+                except Exception:
+                    self.stats["sync_errors"] += 1
+                    raise
+                with self._lock:
+                    self._db.execute(
+                        "UPDATE daily SET synced_sum = synced_sum + ?, synced_count = synced_count + ?,"
+                        " inflight_sum = NULL, inflight_count = NULL, target_sum = NULL, target_count = NULL"
+                        " WHERE day = ?",
+                        (day_sum, day_count, day)
+                    )
+                synced += 1
+        self.stats["synced_days"] += synced
+        self.stats["last_sync"] = time.time()
+        return synced
+
+    # --- отчёты ---
+
+    def totals(self, start: date, end: date) -> list[dict]:
+        """
+        Day rows for start..end with the columns of "Отчёты". Monthly totals
+        accumulate from the first ledger day of each month.
+        """
+        month_start = start.replace(day=1).isoformat()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT day, sum, count FROM daily WHERE day >= ? AND day <= ? ORDER BY day",
+                (month_start, end.isoformat())
+            ).fetchall()
+        result = []
+        month, monthly_sum, monthly_count = None, 0, 0
+        for day, day_sum, day_count in rows:
+            if day[:7] != month:
+                month, monthly_sum, monthly_count = day[:7], 0, 0
+            monthly_sum += day_sum
+            monthly_count += day_count
+            if day >= start.isoformat():
+                result.append({
+                    "date": date.fromisoformat(day).strftime(SHEET_DATE),
+                    "sum": day_sum,
+                    "count": day_count,
+                    "monthly_sum": monthly_sum,
+                    "monthly_count": monthly_count,
+                })
+        return result
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, pending_days=len(self.pending()))
+
+    # --- фоновая задача ---
+
+    async def _sync_loop(self):
+        import google_async
+
+        while True:
+            await asyncio.sleep(SYNC_INTERVAL)
+            try:
+                await google_async.run("sheets", self.sync)
+            except Exception as e:
+                logger.error(f"Синхронизация отчёта не удалась, повторим позже: {e}")
+
+    def start(self):
+        if "DATA_DIR" not in os.environ:
+            logger.warning("Журнал выдач: DATA_DIR не задан, журнал не переживёт передеплой - "
+                           "подключите постоянный том и укажите его путь в DATA_DIR")
+        if SYNC_INTERVAL > 0:
+            self._task = asyncio.create_task(self._sync_loop(), name="ledger-sync")
+            logger.info(f"Синхронизация отчёта каждые {SYNC_INTERVAL:.0f} с, ждут записи дней: {len(self.pending())}")
+
+    async def stop(self):
+        import google_async
+
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Последняя попытка перед выходом; что не записалось, останется в журнале
+        try:
+            await google_async.run("sheets", self.sync)
+        except Exception as e:
+            logger.error(f"Отчёт не синхронизирован перед остановкой: {e}")
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> Ledger:
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            from sheets import _apply_report_delta
+            _ledger = Ledger(_apply_report_delta)
+        return _ledger
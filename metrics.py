@@ -0,0 +1,291 @@
+"""
+Метрики в формате Prometheus.
+
+- middleware aiohttp: длительность и число HTTP-запросов, запросы в работе;
+- middleware aiogram: длительность и ошибки обработчиков;
+- декоратор timed: длительность и ошибки вызовов sheets/drive;
+- фоновая задача: задержка event loop.
+
+Всё отдаётся на /metrics вместе со счётчиками кэшей, очередей и квот.
+Вызовы дольше SLOW_CALL_MS пишутся в лог.
+"""
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SLOW_CALL_MS = float(os.getenv("SLOW_CALL_MS", 1000))
+LOOP_LAG_INTERVAL = 0.5
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value: float):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self):
+        lines = self._header()
+        names = self.label_names + ("le",)
+        with self._lock:
+            for labels, (counts, count, total) in self._values.items():
+                for bound, c in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {c}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+HTTP_REQUESTS = Counter("bot_http_requests_total", "HTTP requests", ("path", "method", "status"))
+HTTP_DURATION = Histogram("bot_http_request_duration_seconds", "HTTP request latency", ("path",))
+HTTP_IN_FLIGHT = Gauge("bot_http_requests_in_flight", "HTTP requests being served")
+HANDLER_DURATION = Histogram("bot_handler_duration_seconds", "aiogram handler latency", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "aiogram handler exceptions", ("handler",))
+GOOGLE_DURATION = Histogram("bot_google_call_duration_seconds", "Sheets/Drive call latency", ("api", "call"))
+GOOGLE_ERRORS = Counter("bot_google_call_errors_total", "Sheets/Drive call exceptions", ("api", "call"))
+GOOGLE_IN_FLIGHT = Gauge("bot_google_calls_in_flight", "Sheets/Drive calls in progress", ("api",))
+LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "Event loop scheduling lag",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+_metrics = [HTTP_REQUESTS, HTTP_DURATION, HTTP_IN_FLIGHT, HANDLER_DURATION, HANDLER_ERRORS,
+            GOOGLE_DURATION, GOOGLE_ERRORS, GOOGLE_IN_FLIGHT, LOOP_LAG]
+_collectors = []
+
+
+def register_collector(name: str, getter, blocking: bool = False):
+    """
+    getter() returns a flat dict of numbers exported as bot_<name>{key="..."}.
+    blocking getters (SQLite and other I/O) are called in a thread.
+    """
+    _collectors.append((name, getter, blocking))
+
+
+def _log_slow(kind: str, name: str, elapsed: float):
+    if elapsed * 1000 >= SLOW_CALL_MS:
+        logger.warning(f"Медленный вызов {kind} {name}: {elapsed * 1000:.0f} мс")
+
+
+def timed(api: str):
+    """Record latency and errors of a blocking sheets/drive function."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            GOOGLE_IN_FLIGHT.inc(api)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                GOOGLE_ERRORS.inc(api, func.__name__)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                GOOGLE_IN_FLIGHT.dec(api)
+                GOOGLE_DURATION.observe(api, func.__name__, value=elapsed)
+                _log_slow(api, func.__name__, elapsed)
+        return wrapper
+    return decorator
+
+
+@web.middleware
+async def http_middleware(request, handler):
+    resource = request.match_info.route.resource
+    path = resource.canonical if resource is not None else "unmatched"
+    HTTP_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        HTTP_IN_FLIGHT.dec()
+        HTTP_REQUESTS.inc(path, request.method, status)
+        HTTP_DURATION.observe(path, value=elapsed)
+        _log_slow("HTTP", path, elapsed)
+
+
+async def handler_middleware(handler, event, data):
+    """aiogram inner middleware timing the matched handler."""
+    handler_object = data.get("handler")
+    name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        HANDLER_ERRORS.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        HANDLER_DURATION.observe(name, value=elapsed)
+        _log_slow("handler", name, elapsed)
+
+
+async def _watch_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG.observe(value=max(0.0, loop.time() - started - LOOP_LAG_INTERVAL))
+
+
+def _collect(blocking: bool) -> dict:
+    collected = {}
+    for name, getter, is_blocking in _collectors:
+        if is_blocking != blocking:
+            continue
+        try:
+            collected[name] = getter()
+        except Exception as e:
+            logger.warning(f"Коллектор метрик {name} упал: {e}")
+    return collected
+
+
+def render(collected: dict | None = None) -> str:
+    """collected - values of blocking collectors, gathered in a thread; None collects them here."""
+    if collected is None:
+        collected = _collect(True)
+    collected = dict(collected, **_collect(False))
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, _, _ in _collectors:
+        if name not in collected:
+            continue
+        values = collected[name]
+        metric_name = f"bot_{name}"
+        lines.append(f"# TYPE {metric_name} gauge")
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                lines.append(f'{metric_name}{{key="{key}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_view(request):
+    # Глубина очереди загрузок и журнал выдач читаются из SQLite, которую
+    # воркеры держат в BEGIN IMMEDIATE до busy_timeout - не на цикле событий
+    collected = await asyncio.to_thread(_collect, True)
+    return web.Response(text=render(collected), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+def _register_default_collectors():
+    import photos
+    import quota
+    import video_stream
+    from google_clients import get_registry
+    from ledger import get_ledger
+    from upload_queue import get_upload_queue
+    from update_queue import get_update_queue
+
+    def quota_stats():
+        flat = {}
+        for bucket, stats in quota.get_scheduler().snapshot().items():
+            for key, value in stats.items():
+                flat[f"{bucket}_{key}"] = value
+        return flat
+
+    def upload_stats():
+        queue = get_upload_queue()
+        return dict(queue.stats, depth=queue.depth())
+
+    register_collector("google_clients", get_registry().snapshot)
+    register_collector("quota", quota_stats)
+    register_collector("uploads", upload_stats, blocking=True)
+    register_collector("updates", lambda: get_update_queue().snapshot())
+    register_collector("ledger", lambda: get_ledger().snapshot(), blocking=True)
+    register_collector("video_stream", lambda: video_stream.stats)
+    register_collector("photos", lambda: photos.stats)
+
+
+def setup(app: web.Application, dp):
+    """Install middlewares, the loop lag monitor and the /metrics route."""
+    app.middlewares.append(http_middleware)
+    app.router.add_get("/metrics", metrics_view)
+    dp.message.middleware(handler_middleware)
+    dp.callback_query.middleware(handler_middleware)
+    _register_default_collectors()
+    if hasattr(dp.storage, "snapshot"):
+        register_collector("fsm", dp.storage.snapshot)
+
+    async def start_lag_monitor(app):
+        app["loop_lag_task"] = asyncio.create_task(_watch_loop_lag())
+
+    async def stop_lag_monitor(app):
+        app["loop_lag_task"].cancel()
+
+    app.on_startup.append(start_lag_monitor)
+    app.on_cleanup.append(stop_lag_monitor)
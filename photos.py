@@ -0,0 +1,105 @@
+"""
+Подготовка и загрузка фото договоров.
+
+Фото пережимаются в JPEG с ограничением по стороне и качеству в пуле
+процессов, чтобы работа Pillow не занимала event loop. Все фото одного
+договора загружаются параллельно в одну папку, найденную один раз.
+"""
+import io
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import drive
+import google_async
+
+logger = logging.getLogger(__name__)
+
+MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", 2048))
+QUALITY = int(os.getenv("PHOTO_QUALITY", 82))
+PROCESSES = int(os.getenv("PHOTO_PROCESSES", 2))
+
+stats = {
+    "photos": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "contracts": 0,
+    "seconds": 0.0,
+}
+
+_executor = None
+
+
+def compress(file_bytes: bytes, max_side: int = MAX_SIDE, quality: int = QUALITY) -> bytes:
+    """Re-encode a photo as JPEG no larger than max_side; keep the original if that is smaller."""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(file_bytes)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    data = out.getvalue()
+    return data if len(data) < len(file_bytes) else file_bytes
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PROCESSES)
+    return _executor
+
+
+async def compress_async(file_bytes: bytes) -> bytes:
+    loop = asyncio.get_running_loop()
+    try:
+        data = await loop.run_in_executor(_get_executor(), compress, file_bytes)
+    except Exception as e:
+        # Нераспознанное изображение загружаем как есть
+        logger.warning(f"Не удалось пережать фото: {e}")
+        data = file_bytes
+    stats["photos"] += 1
+    stats["bytes_in"] += len(file_bytes)
+    stats["bytes_out"] += len(data)
+    return data
+
+
+async def upload_contract_photos(photos: list[tuple[str, bytes]], folder_name: str,
+                                 folder_id: str | None = None) -> str | None:
+    """
+    Compress and upload all photos of one contract concurrently.
+    photos is a list of (filename, bytes). Returns the folder id or None on error.
+    """
+    started = time.monotonic()
+    compressed, folder_id = await asyncio.gather(
+        asyncio.gather(*(compress_async(data) for _, data in photos)),
+        google_async.run("drive", drive.get_or_create_contract_folder, folder_name)
+        if not folder_id else asyncio.sleep(0, folder_id)
+    )
+    if not folder_id:
+        return None
+
+    results = await asyncio.gather(*(
+        google_async.upload_contract_photo(data, filename, folder_name, folder_id)
+        for (filename, _), data in zip(photos, compressed)
+    ))
+    elapsed = time.monotonic() - started
+    stats["contracts"] += 1
+    stats["seconds"] += elapsed
+    logger.info(
+        f"Договор {folder_name}: {len(photos)} фото, "
+        f"{sum(len(d) for _, d in photos) // 1024} -> {sum(len(d) for d in compressed) // 1024} КБ "
+        f"за {elapsed:.1f} с"
+    )
+    if not all(results):
+        return None
+    return folder_id
+
+
+def shutdown():
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,246 @@
+"""
+Общий планировщик квот Google API.
+
+Для каждой пары (API, read/write) заведено ведро токенов с лимитом в
+минуту. Вызовы ждут токен в порядке приоритета: чтения для ответа
+пользователю идут раньше записи отчётов, запись отчётов - раньше
+загрузок файлов. Ответы 429/5xx повторяются с экспоненциальной задержкой
+и случайным разбросом. Глубина очереди и время ожидания доступны в
+snapshot().
+
+Квота Google общая для всех процессов gunicorn, поэтому при нескольких
+воркерах вёдра тоже общие: число токенов хранится в файлах
+DATA_DIR/workers/quota-<api>-<kind>.state и меняется под файловой
+блокировкой. Свободный бюджет простаивающего воркера достаётся
+остальным.
+"""
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+import contextlib
+import contextvars
+
+import workers
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (меньше - раньше)
+USER = 0
+REPORT = 1
+UPLOAD = 2
+
+# Запросов в минуту; по умолчанию с запасом к квотам "per minute per user"
+BUDGETS = {
+    ("sheets", "read"): int(os.getenv("QUOTA_SHEETS_READ", 55)),
+    ("sheets", "write"): int(os.getenv("QUOTA_SHEETS_WRITE", 55)),
+    ("drive", "read"): int(os.getenv("QUOTA_DRIVE_READ", 600)),
+    ("drive", "write"): int(os.getenv("QUOTA_DRIVE_WRITE", 300)),
+}
+BURST_SECONDS = float(os.getenv("QUOTA_BURST_SECONDS", 10))
+MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", 5))
+MAX_BACKOFF = 32.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_lane: contextvars.ContextVar = contextvars.ContextVar("quota_lane", default=None)
+
+
+def error_status(e: Exception) -> int | None:
+    """HTTP status of a Google API error, if any."""
+    resp = getattr(e, "resp", None)  # googleapiclient.errors.HttpError
+    if resp is not None and getattr(resp, "status", None):
+        return int(resp.status)
+    response = getattr(e, "response", None)  # requests / gspread.exceptions.APIError
+    if response is not None and getattr(response, "status_code", None):
+        return int(response.status_code)
+    return None
+
+
+def is_retryable(status: int | None, idempotent: bool = True) -> bool:
+    """429 means the request was rejected and is always safe to resend; 5xx only when idempotent."""
+    if status == 429:
+        return True
+    return idempotent and status in RETRY_STATUSES
+
+
+def backoff(attempt: int) -> float:
+    """Jittered exponential delay before retry number attempt (from 1)."""
+    return min(2 ** attempt, MAX_BACKOFF) * random.uniform(0.5, 1.0)
+
+
+@contextlib.contextmanager
+def lane(priority: int):
+    """Run the enclosed Google calls (also through google_async) at this priority."""
+    token = _lane.set(priority)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int, burst_seconds: float = BURST_SECONDS, shared_path: str | None = None):
+        """shared_path: file with the bucket state shared by all worker processes."""
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._shared_path = shared_path
+        # Время из разных процессов сравнимо только по часам системы
+        self._clock = time.time if shared_path else time.monotonic
+        self.tokens = self.capacity
+        self.updated = self._clock()
+        self.cond = threading.Condition()
+        self.waiters: list = []
+        self.stats = {"calls": 0, "waits": 0, "wait_seconds": 0.0, "max_wait": 0.0,
+                      "throttled": 0, "retries": 0}
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + max(now - self.updated, 0.0) * self.rate)
+        self.updated = now
+
+    def _load(self):
+        try:
+            with open(self._shared_path, "r") as f:
+                tokens, updated = f.read().split()
+            self.tokens, self.updated = float(tokens), float(updated)
+        except (OSError, ValueError):
+            # Первый запуск или оборванная запись - начинаем с полного ведра
+            self.tokens, self.updated = self.capacity, self._clock()
+
+    def _store(self):
+        with open(self._shared_path, "w") as f:
+            f.write(f"{self.tokens!r} {self.updated!r}")
+
+    @contextlib.contextmanager
+    def _state(self):
+        """Up-to-date token count; shared between processes when shared_path is set."""
+        if self._shared_path is None:
+            self._refill()
+            yield
+            return
+        with workers.FileLock(f"{self._shared_path}.lock"):
+            self._load()
+            self._refill()
+            yield
+            self._store()
+
+    def _take(self, n: float) -> float:
+        """Take n tokens; returns 0 on success or seconds until they should be available."""
+        with self._state():
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            return (n - self.tokens) / self.rate
+
+    def acquire(self, priority: int, seq: int, n: int = 1) -> float:
+        """Block until n tokens are available and this waiter is first in line."""
+        started = time.monotonic()
+        n = min(n, self.capacity)
+        with self.cond:
+            ticket = (priority, seq)
+            heapq.heappush(self.waiters, ticket)
+            while True:
+                timeout = None
+                if self.waiters[0] == ticket:
+                    shortfall = self._take(n)
+                    if shortfall == 0:
+                        heapq.heappop(self.waiters)
+                        self.cond.notify_all()
+                        break
+                    timeout = max(shortfall, 0.01)
+                self.cond.wait(timeout)
+            waited = time.monotonic() - started
+            self.stats["calls"] += 1
+            if waited > 0.001:
+                self.stats["waits"] += 1
+                self.stats["wait_seconds"] += waited
+                self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+        return waited
+
+    def penalize(self):
+        """After a 429 drain the bucket so every lane backs off together."""
+        with self.cond, self._state():
+            self.tokens = min(self.tokens, 0.0)
+            self.stats["throttled"] += 1
+
+
+def _shared_path(api: str, kind: str) -> str | None:
+    if not workers.multi():
+        return None
+    return os.path.join(workers.WORKERS_DIR, f"quota-{api}-{kind}.state")
+
+
+class QuotaScheduler:
+    def __init__(self, budgets: dict = BUDGETS):
+        self._buckets = {
+            (api, kind): TokenBucket(per_minute, shared_path=_shared_path(api, kind))
+            for (api, kind), per_minute in budgets.items()
+        }
+        self._seq = itertools.count()
+
+    def _bucket(self, api: str, kind: str) -> TokenBucket:
+        return self._buckets[(api, kind)]
+
+    def acquire(self, api: str, kind: str, priority: int | None = None, n: int = 1) -> float:
+        if priority is None:
+            priority = _lane.get()
+        if priority is None:
+            priority = USER if kind == "read" else REPORT
+        return self._bucket(api, kind).acquire(priority, next(self._seq), n)
+
+    def penalize(self, api: str, kind: str):
+        self._bucket(api, kind).penalize()
+
+    def call(self, api: str, kind: str, func, *args, priority: int | None = None, idempotent: bool = True,
+             **kwargs):
+        """
+        Call func under the (api, kind) budget, retrying 429/5xx with jitter.
+        Non-idempotent calls (files().create) are retried only on 429: after a
+        5xx the server may already have done the work.
+        """
+        bucket = self._bucket(api, kind)
+        attempt = 0
+        while True:
+            self.acquire(api, kind, priority)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                status = error_status(e)
+                if not is_retryable(status, idempotent) or attempt >= MAX_RETRIES:
+                    raise
+                if status == 429:
+                    bucket.penalize()
+                attempt += 1
+                with bucket.cond:
+                    bucket.stats["retries"] += 1
+                delay = backoff(attempt)
+                logger.warning(f"{api} {kind}: ответ {status}, повтор {attempt} через {delay:.1f} с")
+                time.sleep(delay)
+
+    def snapshot(self) -> dict:
+        result = {}
+        for (api, kind), bucket in self._buckets.items():
+            with bucket.cond:
+                result[f"{api}_{kind}"] = dict(bucket.stats, queue_depth=len(bucket.waiters),
+                                               tokens=round(bucket.tokens, 2))
+        return result
+
+
+_scheduler = QuotaScheduler()
+
+
+def get_scheduler() -> QuotaScheduler:
+    return _scheduler
+
+
+def configure(budgets: dict):
+    """Replace the scheduler with new per-minute budgets, e.g. for benchmarks."""
+    global _scheduler
+    _scheduler = QuotaScheduler(budgets)
+
+
+def call(api: str, kind: str, func, *args, priority: int | None = None, idempotent: bool = True, **kwargs):
+    return _scheduler.call(api, kind, func, *args, priority=priority, idempotent=idempotent, **kwargs)
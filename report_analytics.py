@@ -0,0 +1,292 @@
+"""
+Аналитика и исправление истории листа "Отчёты".
+
+    python report_analytics.py                 # сводка и список расхождений
+    python report_analytics.py --apply         # записать исправления
+    python report_analytics.py --out report.json
+
+Лист "Отчёты" и список байков читаются одним запросом values.batchGet и
+раскладываются по колонкам NumPy. Месячные итоги ("Сумма за месяц в
+кассе", "Количество выдач за месяц") пересчитываются как накопленные суммы
+дневных значений внутри календарного месяца, поэтому пропущенные дни их
+не обнуляют. Расхождения с листом записываются одним batch_update.
+Также считаются выручка по месяцам, пропуски и дубли дат и загрузка парка
+по маркам.
+
+С --apply чтение, расчёт и запись идут под той же блокировкой, что и
+синхронизация журнала выдач (ledger.py), иначе её приращения за время
+расчёта были бы перезаписаны. Если в дневных суммах или количествах есть
+нечисловые ячейки, исправления не записываются: месячные итоги без этих
+значений были бы неверными.
+"""
+import re
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from gspread.utils import rowcol_to_a1
+
+import quota
+from ledger import LOCK_PATH
+from workers import FileLock
+from google_clients import get_registry
+from sheets import BIKES_WORKSHEET, REPORTS_WORKSHEET, _find_report_columns
+from bike_cache import BRAND_HEADERS, STATUS_HEADERS, _find_column
+
+DATE_RE = re.compile(r"\d{2}\.\d{2}\.\d{4}")
+RENTED_STATUS = "аренд"
+RECENT_DAYS = 30
+SAMPLE = 10  # сколько примеров расхождений выводить
+
+
+def load():
+    """Read both worksheets with one API call."""
+    spreadsheet = get_registry().spreadsheet()
+    result = quota.call(
+        "sheets", "read", spreadsheet.values_batch_get,
+        [f"'{REPORTS_WORKSHEET}'", f"'{BIKES_WORKSHEET}'"]
+    )
+    reports, bikes = (r.get("values", []) for r in result["valueRanges"])
+    return reports, bikes
+
+
+def _column(rows, col) -> np.ndarray:
+    if col is None:
+        return np.full(len(rows), "", dtype=str)
+    return np.array([row[col].strip() if len(row) > col else "" for row in rows], dtype=str)
+
+
+def _to_int(cells: np.ndarray):
+    """Parse formatted integers; returns (values, mask of unparseable cells)."""
+    if not len(cells):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    # Запятая - десятичный разделитель в русской локали: такие ячейки не целые
+    for separator in (" ", "\u00a0", "₽"):
+        cells = np.char.replace(cells, separator, "")
+    cells = np.where(cells == "", "0", cells)
+    valid = np.char.isdigit(np.char.lstrip(cells, "-"))
+    values = np.zeros(len(cells), dtype=np.int64)
+    values[valid] = cells[valid].astype(np.int64)
+    return values, ~valid
+
+
+def _to_dates(cells: np.ndarray) -> np.ndarray:
+    iso = [f"{d[6:10]}-{d[3:5]}-{d[0:2]}" if DATE_RE.fullmatch(d) else "NaT" for d in cells]
+    try:
+        return np.array(iso, dtype="datetime64[D]")
+    except ValueError:
+        # Есть несуществующие даты вроде 31.02 - разбираем по одной
+        parsed = []
+        for value in iso:
+            try:
+                parsed.append(np.datetime64(value, "D"))
+            except ValueError:
+                parsed.append(np.datetime64("NaT"))
+        return np.array(parsed, dtype="datetime64[D]")
+
+
+def _monthly_cumsum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Running total of values that restarts at every True in starts."""
+    total = np.cumsum(values)
+    start_positions = np.flatnonzero(starts)
+    base = (total - values)[start_positions]
+    lengths = np.diff(np.append(start_positions, len(values)))
+    return total - np.repeat(base, lengths)
+
+
+def analyze_reports(rows) -> dict:
+    """Recompute monthly totals of "Отчёты" and collect corrections."""
+    headers = rows[0] if rows else []
+    columns = _find_report_columns(headers)
+    data = rows[1:]
+
+    dates = _to_dates(_column(data, columns["date"]))
+    sums, bad_sums = _to_int(_column(data, columns["sum"]))
+    counts, bad_counts = _to_int(_column(data, columns["count"]))
+    monthly_sums, _ = _to_int(_column(data, columns["monthly_sum"]))
+    monthly_counts, _ = _to_int(_column(data, columns["monthly_count"]))
+
+    # Строки без даты не участвуют; остальные упорядочиваем по дате
+    dated = np.flatnonzero(~np.isnat(dates))
+    order = dated[np.argsort(dates[dated], kind="stable")]
+    days = dates[order]
+    months = days.astype("datetime64[M]")
+    starts = np.ones(len(days), dtype=bool)
+    starts[1:] = months[1:] != months[:-1]
+
+    expected = {
+        "monthly_sum": _monthly_cumsum(sums[order], starts),
+        "monthly_count": _monthly_cumsum(counts[order], starts),
+    }
+    current = {"monthly_sum": monthly_sums[order], "monthly_count": monthly_counts[order]}
+
+    corrections = []
+    for key in ("monthly_sum", "monthly_count"):
+        col = columns[key]
+        if col is None:
+            continue
+        wrong = np.flatnonzero(expected[key] != current[key])
+        for i in wrong:
+            corrections.append({
+                "row": int(order[i]) + 2,  # +1 заголовок, +1 нумерация с единицы
+                "col": col + 1,
+                "column": headers[col],
+                "old": int(current[key][i]),
+                "new": int(expected[key][i]),
+            })
+
+    gaps = np.flatnonzero(np.diff(days).astype(np.int64) > 1)
+    duplicates = np.flatnonzero(days[1:] == days[:-1])
+
+    month_keys, month_starts = np.unique(months, return_index=True)
+    by_month = []
+    if len(days):
+        month_sums = np.add.reduceat(sums[order], month_starts)
+        month_counts = np.add.reduceat(counts[order], month_starts)
+        month_days = np.diff(np.append(month_starts, len(days)))
+        for month, total, count, n_days in zip(month_keys, month_sums, month_counts, month_days):
+            by_month.append({"month": str(month), "sum": int(total), "count": int(count), "days": int(n_days)})
+
+    recent = np.zeros(len(days), dtype=bool)
+    if len(days):
+        recent = days >= days[-1] - np.timedelta64(RECENT_DAYS - 1, "D")
+    return {
+        "rows": len(data),
+        "dated_rows": len(days),
+        "first_day": str(days[0]) if len(days) else None,
+        "last_day": str(days[-1]) if len(days) else None,
+        "total_sum": int(sums[order].sum()),
+        "total_count": int(counts[order].sum()),
+        "recent_sum": int(sums[order][recent].sum()),
+        "unparsed_cells": int(bad_sums.sum() + bad_counts.sum()),
+        "gaps": [{"after": str(days[i]), "missing_days": int((days[i + 1] - days[i]).astype(np.int64) - 1)}
+                 for i in gaps],
+        "duplicate_days": sorted({str(days[i]) for i in duplicates}),
+        "by_month": by_month,
+        "corrections": corrections,
+    }
+
+
+def analyze_bikes(rows, recent_sum: int) -> dict:
+    """Fleet size, rented bikes and utilization per brand."""
+    headers = rows[0] if rows else []
+    data = [row for row in rows[1:] if any(cell.strip() for cell in row)]
+    brands = np.char.lower(_column(data, _find_column(headers, BRAND_HEADERS)))
+    statuses = np.char.lower(_column(data, _find_column(headers, STATUS_HEADERS)))
+    rented = np.char.find(statuses, RENTED_STATUS) >= 0
+
+    names, inverse = np.unique(brands, return_inverse=True)
+    totals = np.bincount(inverse, minlength=len(names))
+    rented_totals = np.bincount(inverse, weights=rented, minlength=len(names)).astype(np.int64)
+    by_brand = [
+        {"brand": name or "-", "bikes": int(total), "rented": int(busy),
+         "utilization": round(float(busy) / total, 3)}
+        for name, total, busy in zip(names, totals, rented_totals)
+    ]
+    fleet = len(data)
+    rented_now = int(rented.sum())
+    return {
+        "bikes": fleet,
+        "rented": rented_now,
+        "utilization": round(rented_now / fleet, 3) if fleet else 0.0,
+        # Выручка в отчёте не привязана к байку - считаем средние на байк
+        "revenue_per_bike_day": round(recent_sum / fleet / RECENT_DAYS, 2) if fleet else 0.0,
+        "revenue_per_rented_bike_day": round(recent_sum / rented_now / RECENT_DAYS, 2) if rented_now else 0.0,
+        "by_brand": by_brand,
+    }
+
+
+def apply_corrections(corrections) -> int:
+    if not corrections:
+        return 0
+    sheet = get_registry().worksheet(REPORTS_WORKSHEET)
+    quota.call(
+        "sheets", "write", sheet.batch_update,
+        [{"range": rowcol_to_a1(c["row"], c["col"]), "values": [[c["new"]]]} for c in corrections],
+        value_input_option="USER_ENTERED",
+        priority=quota.REPORT
+    )
+    return len(corrections)
+
+
+def _run(apply: bool) -> dict:
+    timings = {}
+    started = time.perf_counter()
+    reports, bikes = load()
+    timings["read"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    report = analyze_reports(reports)
+    report["fleet"] = analyze_bikes(bikes, report["recent_sum"])
+    timings["compute"] = time.perf_counter() - started
+
+    if apply and report["unparsed_cells"]:
+        report["applied"] = 0
+        report["refused"] = f"нечисловых ячеек: {report['unparsed_cells']}"
+    elif apply:
+        started = time.perf_counter()
+        report["applied"] = apply_corrections(report["corrections"])
+        timings["write"] = time.perf_counter() - started
+    report["timings"] = {key: round(value, 4) for key, value in timings.items()}
+    return report
+
+
+def run(apply: bool = False) -> dict:
+    if not apply:
+        return _run(apply)
+    # Синхронизация журнала выдач не должна попасть между чтением и записью
+    with FileLock(LOCK_PATH):
+        return _run(apply)
+
+
+def _print(report: dict):
+    print(f"Строк в отчёте: {report['rows']}, с датой: {report['dated_rows']}, "
+          f"период {report['first_day']} - {report['last_day']}")
+    print(f"Выручка: {report['total_sum']}, выдач: {report['total_count']}, "
+          f"за последние {RECENT_DAYS} дней: {report['recent_sum']}")
+    for month in report["by_month"][-12:]:
+        print(f"  {month['month']}: {month['sum']} ({month['count']} выдач, {month['days']} дней)")
+    if report["gaps"]:
+        print(f"Пропуски дат: {len(report['gaps'])}, например после {report['gaps'][0]['after']}")
+    if report["duplicate_days"]:
+        print(f"Повторяющиеся даты: {', '.join(report['duplicate_days'][:SAMPLE])}")
+    if report["unparsed_cells"]:
+        print(f"Нечисловых ячеек (посчитаны как 0): {report['unparsed_cells']}")
+
+    fleet = report["fleet"]
+    print(f"Парк: {fleet['bikes']} байков, в аренде {fleet['rented']} ({fleet['utilization']:.0%}), "
+          f"выручка на байк в день: {fleet['revenue_per_bike_day']}")
+    for brand in fleet["by_brand"]:
+        print(f"  {brand['brand']}: {brand['rented']}/{brand['bikes']} ({brand['utilization']:.0%})")
+
+    corrections = report["corrections"]
+    print(f"Расхождений месячных итогов: {len(corrections)}")
+    for c in corrections[:SAMPLE]:
+        print(f"  строка {c['row']}, {c['column']}: {c['old']} -> {c['new']}")
+    if "refused" in report:
+        print(f"Исправления не записаны ({report['refused']}): поправьте эти ячейки и запустите снова")
+    elif "applied" in report:
+        print(f"Исправлено ячеек: {report['applied']}")
+    elif corrections:
+        print("Запустите с --apply, чтобы записать исправления")
+    print("Время, с: " + ", ".join(f"{k} {v}" for k, v in report["timings"].items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="записать исправления в лист")
+    parser.add_argument("--out", help="сохранить полный результат в JSON")
+    args = parser.parse_args(argv)
+
+    report = run(apply=args.apply)
+    _print(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if "refused" in report else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Индекс листа "Отчёты": дата -> номер строки и позиции колонок.
+
+Индекс хранится на диске и переживает перезапуски. Полное чтение листа
+нужно только для построения индекса; в остальных случаях читаются лишь
+заголовок и нужные строки, а расхождение с индексом (изменились
+заголовки, строки сдвинули руками) приводит к перестроению. Даты индекса
+также разложены по месяцам в отсортированные списки, чтобы предыдущий
+день месяца находился бинарным поиском, а не перебором всех строк.
+"""
+import os
+import json
+import bisect
+import hashlib
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", ".data")
+INDEX_PATH = os.path.join(DATA_DIR, "reports_index.json")
+
+
+def header_hash(headers) -> str:
+    return hashlib.sha1("\t".join(headers).encode("utf-8")).hexdigest()
+
+
+def _month_day(date: str):
+    """((year, month), day) of a дд.мм.гггг date or None."""
+    try:
+        parsed = datetime.strptime(date, "%d.%m.%Y")
+    except ValueError:
+        return None
+    return (parsed.year, parsed.month), parsed.day
+
+
+class ReportsIndex:
+    def __init__(self, path: str = INDEX_PATH):
+        self._path = path
+        self.header_hash = None
+        self.columns: dict[str, int | None] = {}
+        self.rows: dict[str, int] = {}
+        self.last_row = 0
+        # (год, месяц) -> отсортированный список (день, дата как в листе)
+        self._months: dict[tuple, list[tuple[int, str]]] = {}
+        self.stats = {"rebuilds": 0, "hits": 0}
+        self._load()
+
+    @property
+    def ready(self) -> bool:
+        return self.header_hash is not None and self.columns.get("date") is not None
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.header_hash = data["header_hash"]
+            self.columns = data["columns"]
+            self.rows = data["rows"]
+            self.last_row = data["last_row"]
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Индекс отчётов повреждён, будет перестроен: {e}")
+            self.header_hash = None
+        self._index_months()
+
+    def _index_months(self):
+        self._months = {}
+        for date in self.rows:
+            self._add_month_day(date)
+
+    def _add_month_day(self, date: str):
+        parsed = _month_day(date)
+        if parsed is not None:
+            bisect.insort(self._months.setdefault(parsed[0], []), (parsed[1], date))
+
+    def previous_day(self, date: str) -> str | None:
+        """Latest indexed date before date in the same month, or None."""
+        parsed = _month_day(date)
+        if parsed is None:
+            return None
+        days = self._months.get(parsed[0], [])
+        i = bisect.bisect_left(days, (parsed[1], ""))
+        return days[i - 1][1] if i else None
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        tmp_path = f"{self._path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "header_hash": self.header_hash,
+                "columns": self.columns,
+                "rows": self.rows,
+                "last_row": self.last_row,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path)
+
+    def rebuild(self, all_data, columns):
+        """Build the index from a full read of the sheet."""
+        headers = all_data[0] if all_data else []
+        self.header_hash = header_hash(headers)
+        self.columns = columns
+        self.rows = {}
+        date_col = columns["date"]
+        for row_idx, row in enumerate(all_data[1:], start=2):
+            if date_col is not None and len(row) > date_col and row[date_col]:
+                # При повторах даты берём первую строку, как и раньше
+                self.rows.setdefault(row[date_col], row_idx)
+        self._index_months()
+        self.last_row = len(all_data)
+        self.stats["rebuilds"] += 1
+        self.save()
+        logger.info(f"Индекс отчётов перестроен: {len(self.rows)} дат, последняя строка {self.last_row}")
+
+    def remember(self, date: str, row: int):
+        if date not in self.rows:
+            self._add_month_day(date)
+        self.rows[date] = row
+        self.last_row = max(self.last_row, row)
+        self.save()
@@ -1,136 +1,214 @@
-import os
-import json
-import gspread
-from google.oauth2.service_account import Credentials
+import quota
+import ledger
+import metrics
+from google_clients import get_registry
 
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"
-]
-
-SPREADSHEET_ID = "1xrCL9RBJHfNQGETgLLvnQtrSErNhQPeYkaXVSKkjSQo"
+BIKES_WORKSHEET = "список наших байков"
+REPORTS_WORKSHEET = "Отчёты"
 
+@metrics.timed("sheets")
 def get_sheet():
-    creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-    creds = Credentials.from_service_account_info(
-        creds_dict,
-        scopes=SCOPES
-    )
-
-    client = gspread.authorize(creds)
-    spreadsheet = client.open_by_key(SPREADSHEET_ID)
-    return spreadsheet.worksheet("список наших байков")
+    return get_registry().worksheet(BIKES_WORKSHEET)
 
+@metrics.timed("sheets")
 def get_reports_sheet():
-    creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-    creds = Credentials.from_service_account_info(
-        creds_dict,
-        scopes=SCOPES
-    )
+    return get_registry().worksheet(REPORTS_WORKSHEET)
 
 
-    client = gspread.authorize(creds)
-    spreadsheet = client.open_by_key(SPREADSHEET_ID)
-    return spreadsheet.worksheet("Отчёты")
-
-
-def update_reports(rental_sum):
-    from datetime import datetime, timedelta
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    sheet = get_reports_sheet()
-    today = datetime.now().strftime("%d.%m.%Y")
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%d.%m.%Y")
-    
-    all_data = sheet.get_all_values()
-    
-    headers = all_data[0] if all_data else []
-    logger.info(f"Headers found: {headers}")
-    
-    date_col = None
-    sum_col = None
-    count_col = None
-    monthly_sum_col = None
-    monthly_count_col = None
-    
+def _find_report_columns(headers):
+    """Возвращает индексы колонок отчёта (0-based) по заголовкам."""
+    columns = {
+        "date": None,
+        "sum": None,
+        "count": None,
+        "monthly_sum": None,
+        "monthly_count": None,
+    }
     for i, header in enumerate(headers):
         header_lower = header.lower().strip()
-        logger.info(f"Checking header '{header}' at index {i}")
         if "дата" in header_lower:
-            date_col = i
+            columns["date"] = i
         elif "сумма выдачи" in header_lower:
-            sum_col = i
+            columns["sum"] = i
         elif "количество выдач" in header_lower and "месяц" not in header_lower:
-            count_col = i
+            columns["count"] = i
         elif "сумма за месяц в кассе" in header_lower:
-            monthly_sum_col = i
+            columns["monthly_sum"] = i
         elif "количество выдач за месяц" in header_lower:
-            monthly_count_col = i
-    
-    logger.info(f"Column indices: date_col={date_col}, sum_col={sum_col}, count_col={count_col}, monthly_sum_col={monthly_sum_col}, monthly_count_col={monthly_count_col}")
-    
-    # Ищем строку с сегодняшней датой
-    today_row = None
-    for row_idx, row in enumerate(all_data[1:], start=2):  # start=2 т.к. строка 1 - заголовки
-        if len(row) > date_col and row[date_col] == today:
-            today_row = row_idx
-            break
-    
-    # Ищем строку за предыдущий день для накопительных итогов
-    yesterday_row = None
-    yesterday_monthly_sum = 0
-    yesterday_monthly_count = 0
-    for row_idx, row in enumerate(all_data[1:], start=2):
-        if len(row) > date_col and row[date_col] == yesterday:
-            yesterday_row = row_idx
-            if monthly_sum_col is not None and len(row) > monthly_sum_col:
-                yesterday_monthly_sum = int(row[monthly_sum_col] or 0)
-            if monthly_count_col is not None and len(row) > monthly_count_col:
-                yesterday_monthly_count = int(row[monthly_count_col] or 0)
-            break
-    
-    logger.info(f"Yesterday values: sum={yesterday_monthly_sum}, count={yesterday_monthly_count}")
-    
+            columns["monthly_count"] = i
+    return columns
+
+
+def _cell_int(row, col):
+    if col is None or len(row) <= col:
+        return 0
+    return int(row[col] or 0)
+
+
+_reports_index = None
+
+
+def _get_reports_index():
+    from reports_index import ReportsIndex
+    global _reports_index
+
+    if _reports_index is None:
+        _reports_index = ReportsIndex()
+    return _reports_index
+
+
+def _read_report_rows(sheet, index, today, yesterday):
+    """
+    Читает заголовок, строки за сегодня и предыдущий день месяца и
+    строку-кандидат для нового дня одним batch_get. Возвращает None, если индекс устарел.
+    """
+    from reports_index import header_hash
+
+    date_col = index.columns["date"]
+    today_row = index.rows.get(today)
+    yesterday_row = index.rows.get(yesterday)
+    new_row = index.last_row + 1
+
+    ranges = ["1:1", f"{new_row}:{new_row}"]
+    if today_row:
+        ranges.append(f"{today_row}:{today_row}")
+    if yesterday_row:
+        ranges.append(f"{yesterday_row}:{yesterday_row}")
+    results = quota.call("sheets", "read", sheet.batch_get, ranges)
+    rows = [result[0] if result else [] for result in results]
+
+    if header_hash(rows[0]) != index.header_hash:
+        return None
+    # Строка после последней известной должна быть пустой, иначе лист дописывали вручную
+    if any(cell.strip() for cell in rows[1]):
+        return None
+
+    found = {}
+    extra = iter(rows[2:])
+    for key, row_number, date in (("today", today_row, today), ("yesterday", yesterday_row, yesterday)):
+        if not row_number:
+            found[key] = (None, None)
+            continue
+        values = next(extra)
+        if len(values) <= date_col or values[date_col] != date:
+            return None
+        found[key] = (row_number, values)
+    index.stats["hits"] += 1
+    return found
+
+
+def _apply_report_delta(day, rental_sum, rental_count, expected=None, before_write=None):
+    """
+    Добавляет сумму и количество выдач в строку отчёта за день day (дд.мм.гггг).
+    Нужные строки находятся по индексу дат и читаются диапазонами; итоговая
+    строка считается в памяти и записывается одним batch_update.
+    expected - итоги (сумма, количество) строки после прошлой неподтверждённой
+    записи: если они уже в строке, приращение не добавляется повторно.
+    before_write(сумма, количество) вызывается с новыми итогами перед записью.
+    """
+    import logging
+    from gspread.utils import rowcol_to_a1
+    logger = logging.getLogger(__name__)
+
+    sheet = get_reports_sheet()
+    index = _get_reports_index()
+    today = day
+    # Месячные итоги продолжаются от последнего дня месяца, за который есть строка:
+    # пропущенный день не должен обнулять их
+    yesterday = index.previous_day(day)
+
+    found = _read_report_rows(sheet, index, today, yesterday) if index.ready else None
+    if found is None:
+        all_data = quota.call("sheets", "read", sheet.get_all_values)
+        headers = all_data[0] if all_data else []
+        index.rebuild(all_data, _find_report_columns(headers))
+        yesterday = index.previous_day(day)
+        found = {}
+        for key, date in (("today", today), ("yesterday", yesterday)):
+            row_number = index.rows.get(date)
+            found[key] = (row_number, all_data[row_number - 1] if row_number else None)
+
+    columns = index.columns
+    date_col = columns["date"]
+    logger.info(f"Column indices: {columns}")
+    today_row, today_values = found["today"]
+    yesterday_values = found["yesterday"][1]
+
+    updates = {}
     if today_row is None:
-        # Создаём новую строку с сегодняшней датой
-        today_row = len(all_data) + 1
-        sheet.update_cell(today_row, date_col + 1, today)
-        # Инициализируем нулями
-        if sum_col is not None:
-            sheet.update_cell(today_row, sum_col + 1, 0)
-        if count_col is not None:
-            sheet.update_cell(today_row, count_col + 1, 0)
-        if monthly_sum_col is not None:
-            sheet.update_cell(today_row, monthly_sum_col + 1, yesterday_monthly_sum)
-        if monthly_count_col is not None:
-            sheet.update_cell(today_row, monthly_count_col + 1, yesterday_monthly_count)
-        logger.info(f"Created new row {today_row} for today")
-    
-    # Обновляем сумму выдачи за сегодня
-    if sum_col is not None:
-        current_sum = int(sheet.cell(today_row, sum_col + 1).value or 0)
-        sheet.update_cell(today_row, sum_col + 1, current_sum + rental_sum)
-        logger.info(f"Updated sum_col: {current_sum} + {rental_sum}")
-    
-    # Увеличиваем количество выдач за сегодня
-    if count_col is not None:
-        current_count = int(sheet.cell(today_row, count_col + 1).value or 0)
-        sheet.update_cell(today_row, count_col + 1, current_count + 1)
-        logger.info(f"Updated count_col: {current_count} + 1")
-    
-    # Обновляем месячные итоги (накопительно)
-    if monthly_sum_col is not None:
-        current_monthly_sum = int(sheet.cell(today_row, monthly_sum_col + 1).value or 0)
-        sheet.update_cell(today_row, monthly_sum_col + 1, current_monthly_sum + rental_sum)
-        logger.info(f"Updated monthly_sum_col: {current_monthly_sum} + {rental_sum}")
-    
-    if monthly_count_col is not None:
-        current_monthly_count = int(sheet.cell(today_row, monthly_count_col + 1).value or 0)
-        sheet.update_cell(today_row, monthly_count_col + 1, current_monthly_count + 1)
-        logger.info(f"Updated monthly_count_col: {current_monthly_count} + 1")
+        # Новая строка: дневные итоги с нуля, месячные - от вчерашних
+        today_row = index.last_row + 1
+        yesterday_values = yesterday_values or []
+        updates[date_col] = today
+        current = {
+            "sum": 0,
+            "count": 0,
+            "monthly_sum": _cell_int(yesterday_values, columns["monthly_sum"]),
+            "monthly_count": _cell_int(yesterday_values, columns["monthly_count"]),
+        }
+        logger.info(f"Creating new row {today_row} for today, yesterday totals: {current}")
+    else:
+        current = {
+            key: _cell_int(today_values, columns[key])
+            for key in ("sum", "count", "monthly_sum", "monthly_count")
+        }
+        if expected is not None and (current["sum"], current["count"]) == tuple(expected):
+            # Прошлая запись дошла до таблицы, хотя ответ был потерян
+            index.remember(today, today_row)
+            logger.info(f"Report row {today_row} already holds {expected}, skipping")
+            return
+
+    deltas = {
+        "sum": rental_sum,
+        "count": rental_count,
+        "monthly_sum": rental_sum,
+        "monthly_count": rental_count,
+    }
+    for key, delta in deltas.items():
+        col = columns[key]
+        if col is None:
+            continue
+        # Нулевые приращения (количество при продлении) пишем только в новую строку
+        if delta == 0 and today_values is not None:
+            continue
+        updates[col] = current[key] + delta
+
+    if before_write is not None:
+        before_write(current["sum"] + rental_sum, current["count"] + rental_count)
+    quota.call(
+        "sheets", "write", sheet.batch_update,
+        [
+            {"range": rowcol_to_a1(today_row, col + 1), "values": [[value]]}
+            for col, value in updates.items()
+        ],
+        value_input_option="USER_ENTERED",
+        priority=quota.REPORT
+    )
+    index.remember(today, today_row)
+    logger.info(f"Updated report row {today_row}: {updates}")
+
+
+def _record_report(kind, rental_sum, rental_count):
+    """Записывает выдачу или продление в локальный журнал (ledger.py)."""
+    journal = ledger.get_ledger()
+    journal.record(kind, rental_sum, rental_count)
+    if ledger.SYNC_INTERVAL <= 0:
+        journal.sync()
+
 
+@metrics.timed("sheets")
+def update_reports(rental_sum):
+    """
+    Обновляет отчёт при выдаче байка.
+    - Находит или создаёт строку с сегодняшней датой
+    - Добавляет сумму к "Сумма выдачи" и "Сумма за месяц в кассе"
+    - Увеличивает "Количество выдач" и "Количество выдач за месяц"
+    Выдача сразу сохраняется в журнал, в таблицу она попадает при синхронизации.
+    """
+    _record_report(ledger.KIND_RENTAL, rental_sum, 1)
 
+
+@metrics.timed("sheets")
 def update_reports_extend(rental_sum):
     """
     Обновляет отчёт при продлении байка (только суммы, без увеличения количества выдач).
@@ -138,64 +216,6 @@ def update_reports_extend(rental_sum):
     - Добавляет сумму к "Сумма выдачи"
     - Добавляет сумму к "Сумма за месяц в кассе"
     - НЕ увеличивает "Количество выдач" и "Количество выдач за месяц"
+    Продление сразу сохраняется в журнал, в таблицу оно попадает при синхронизации.
     """
-    from datetime import datetime, timedelta
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    sheet = get_reports_sheet()
-    today = datetime.now().strftime("%d.%m.%Y")
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%d.%m.%Y")
-    
-    # Получаем все данные
-    all_data = sheet.get_all_values()
-    
-    # Находим заголовки (первая строка)
-    headers = all_data[0] if all_data else []
-    
-    # Определяем индексы колонок
-    date_col = None
-    sum_col = None
-    monthly_sum_col = None
-    
-    for i, header in enumerate(headers):
-        header_lower = header.lower().strip()
-        if "дата" in header_lower:
-            date_col = i
-        elif "сумма выдачи" in header_lower:
-            sum_col = i
-        elif "сумма за месяц в кассе" in header_lower:
-            monthly_sum_col = i
-    
-    # Ищем строку с сегодняшней датой
-    today_row = None
-    for row_idx, row in enumerate(all_data[1:], start=2):
-        if len(row) > date_col and row[date_col] == today:
-            today_row = row_idx
-            break
-    
-    # Ищем строку за предыдущий день для накопительных итогов
-    yesterday_monthly_sum = 0
-    for row_idx, row in enumerate(all_data[1:], start=2):
-        if len(row) > date_col and row[date_col] == yesterday:
-            if monthly_sum_col is not None and len(row) > monthly_sum_col:
-                yesterday_monthly_sum = int(row[monthly_sum_col] or 0)
-            break
-    
-    if today_row is None:
-        # Создаём новую строку с сегодняшней датой
-        today_row = len(all_data) + 1
-        sheet.update_cell(today_row, date_col + 1, today)
-        if sum_col is not None:
-            sheet.update_cell(today_row, sum_col + 1, 0)
-        if monthly_sum_col is not None:
-            sheet.update_cell(today_row, monthly_sum_col + 1, yesterday_monthly_sum)
-    
-    # Обновляем только суммы (без увеличения количества выдач)
-    if sum_col is not None:
-        current_sum = int(sheet.cell(today_row, sum_col + 1).value or 0)
-        sheet.update_cell(today_row, sum_col + 1, current_sum + rental_sum)
-    
-    if monthly_sum_col is not None:
-        current_monthly_sum = int(sheet.cell(today_row, monthly_sum_col + 1).value or 0)
-        sheet.update_cell(today_row, monthly_sum_col + 1, current_monthly_sum + rental_sum)
+    _record_report(ledger.KIND_EXTENSION, rental_sum, 0)
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Модули бота читают DATA_DIR и токен при импорте
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bot-tests-"))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
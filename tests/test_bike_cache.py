@@ -0,0 +1,55 @@
+"""Зеркало списка байков: своя запись не откатывается параллельным обновлением."""
+import threading
+
+import pytest
+
+import fakes
+import quota
+from bike_cache import BikeCache
+
+HEADERS = ["ID", "Марка", "Статус"]
+
+
+class _SlowSheet(fakes.FakeWorksheet):
+    def __init__(self):
+        super().__init__("список наших байков", [HEADERS, ["1", "Honda", "свободен"]], fakes.FaultInjector())
+        self.writing = threading.Event()
+        self.write_done = threading.Event()
+
+    def update_cell(self, row, col, value):
+        self.writing.set()
+        self.write_done.wait(5)
+        super().update_cell(row, col, value)
+
+    def get_all_values(self):
+        rows = super().get_all_values()
+        # Ответ на чтение приходит позже, чем запись успевает примениться
+        self.write_done.wait(5)
+        threading.Event().wait(0.2)
+        return rows
+
+
+@pytest.fixture(autouse=True)
+def unlimited_quota(monkeypatch):
+    monkeypatch.setattr(quota, "_scheduler", quota.QuotaScheduler({key: 10 ** 9 for key in quota.BUDGETS}))
+
+
+def test_refresh_does_not_revert_own_write():
+    sheet = _SlowSheet()
+    sheet.write_done.set()
+    cache = BikeCache(ttl=60, sheet_getter=lambda: sheet)
+    cache.refresh()
+    sheet.write_done.clear()
+
+    writer = threading.Thread(target=cache.update, args=("1", "Статус", "в аренде"))
+    writer.start()
+    assert sheet.writing.wait(5)
+    # Обновление по таймеру начинается, пока запись ещё в пути
+    refresher = threading.Thread(target=cache.refresh, kwargs={"force": True})
+    refresher.start()
+    threading.Event().wait(0.05)
+    sheet.write_done.set()
+    writer.join(5)
+    refresher.join(5)
+
+    assert cache.get("1")["Статус"] == "в аренде"
@@ -0,0 +1,141 @@
+"""
+Запросы к Drive на подделке fakes.FakeDrive: batch-запросы, пакетный
+поиск и создание папок, повтор только безопасных запросов.
+"""
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import fakes
+import quota
+import drive
+from drive_batch import DriveBatcher
+from folder_cache import FolderCache
+
+
+def _error(status):
+    payload = {"error": {"code": status, "message": "fake", "status": "UNAVAILABLE"}}
+    return HttpError(httplib2.Response({"status": status}), json.dumps(payload).encode())
+
+
+class _LostCreate:
+    """files() of FakeDrive where the first create succeeds but answers 503."""
+
+    def __init__(self, fake):
+        self._files = fake.files()
+        self.creates = 0
+
+    def list(self, **kwargs):
+        return self._files.list(**kwargs)
+
+    def create(self, **kwargs):
+        request = self._files.create(**kwargs)
+        run = request._run
+
+        def lost():
+            self.creates += 1
+            result = run()
+            if self.creates == 1:
+                raise _error(503)
+            return result
+
+        request._run = lost
+        return request
+
+
+@pytest.fixture
+def fake_drive(monkeypatch):
+    monkeypatch.setattr(quota, "_scheduler", quota.QuotaScheduler({key: 10 ** 9 for key in quota.BUDGETS}))
+    monkeypatch.setattr(quota, "MAX_BACKOFF", 0.01)
+    fake = fakes.FakeDrive(fakes.FaultInjector())
+    batcher = DriveBatcher(window=0, service_getter=lambda: fake)
+    monkeypatch.setattr(drive, "get_batcher", lambda: batcher)
+    monkeypatch.setattr(drive, "_folder_cache", FolderCache(None))
+    return fake
+
+
+class _Throttled:
+    """Request that answers 429 the first `fails` times across rebuilds."""
+
+    def __init__(self, state, result):
+        self._state = state
+        self._result = result
+
+    def _run(self):
+        if self._state["fails"]:
+            self._state["fails"] -= 1
+            raise _error(429)
+        return self._result
+
+    execute = _run
+
+
+def test_batch_demultiplexes_mixed_results(fake_drive, monkeypatch):
+    folder_id = fake_drive.add_folder("bike", "root")
+    fake_drive.delete("gone")
+    batcher = DriveBatcher(window=0.05, service_getter=lambda: fake_drive)
+    throttled = {"fails": 1}
+
+    ok = batcher.submit(lambda d: d.files().list(q=drive._folder_query("bike", "root"), fields="files(id)"))
+    missing = batcher.submit(lambda d: d.files().list(q=drive._folder_query("x", "gone"), fields="files(id)"))
+    retried = batcher.submit(lambda d: _Throttled(throttled, {"id": "after-429"}))
+
+    assert drive._folder_id(ok.result(5)) == folder_id
+    with pytest.raises(HttpError) as raised:
+        missing.result(5)
+    assert raised.value.resp.status == 404
+    assert retried.result(5) == {"id": "after-429"}
+    assert batcher.stats["retries"] == 1
+    # Три запроса ушли одним batch, повтор - отдельным
+    assert fake_drive.injector.calls["drive.batch"] == 1
+    assert batcher.stats["batches"] == 2
+
+
+def test_check_folders_exist(fake_drive):
+    folder_id = fake_drive.add_folder("bike", drive.ROOT_FOLDER_ID)
+
+    assert drive.check_folders_exist(["bike", "other"]) == {"bike": folder_id, "other": None}
+    calls = dict(fake_drive.injector.calls)
+    assert drive.check_folders_exist(["bike", "other"]) == {"bike": folder_id, "other": None}
+    assert fake_drive.injector.calls == calls
+
+
+def test_get_or_create_folders(fake_drive):
+    bike_id = fake_drive.add_folder("bike", drive.ROOT_FOLDER_ID)
+    specs = [("bike", drive.ROOT_FOLDER_ID), ("contract", drive.CONTRACTS_FOLDER_ID), ("bike", drive.ROOT_FOLDER_ID)]
+
+    ids = drive.get_or_create_folders(specs)
+
+    contract = [f for f in fake_drive.files_by_id.values() if f["name"] == "contract"]
+    assert [f["parents"] for f in contract] == [[drive.CONTRACTS_FOLDER_ID]]
+    assert ids == [bike_id, contract[0]["id"], bike_id]
+    calls = dict(fake_drive.injector.calls)
+    assert drive.get_or_create_folders(specs) == ids
+    assert fake_drive.injector.calls == calls
+
+
+def test_non_idempotent_call_retries_only_429(monkeypatch):
+    monkeypatch.setattr(quota, "MAX_BACKOFF", 0.01)
+    scheduler = quota.QuotaScheduler({key: 10 ** 9 for key in quota.BUDGETS})
+    errors = [_error(429), _error(503)]
+
+    def create():
+        raise errors.pop(0)
+
+    with pytest.raises(HttpError) as raised:
+        scheduler.call("drive", "write", create, idempotent=False)
+    assert raised.value.resp.status == 503
+    assert errors == []
+
+
+def test_folder_create_after_lost_5xx_is_not_duplicated(fake_drive, monkeypatch):
+    files = _LostCreate(fake_drive)
+    monkeypatch.setattr(fake_drive, "files", lambda: files)
+
+    folder_id = drive._create_folder(fake_drive, "bike", "root")
+
+    folders = [f for f in fake_drive.files_by_id.values() if f["name"] == "bike"]
+    assert [f["id"] for f in folders] == [folder_id]
+    assert files.creates == 1
@@ -0,0 +1,50 @@
+"""
+Кэш папок Drive при нескольких воркерах: два FolderCache на одном файле
+изображают два процесса gunicorn.
+"""
+import json
+
+import pytest
+
+import workers
+from folder_cache import FolderCache
+
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(workers, "COUNT", 2)
+    path = str(tmp_path / "folders.json")
+    return FolderCache(path), FolderCache(path), path
+
+
+def _saved(path):
+    with open(path, encoding="utf-8") as f:
+        return {(p, n): i for p, n, i in json.load(f)}
+
+
+def test_second_worker_sees_created_folder(caches):
+    a, b, _ = caches
+    created = []
+
+    def creator():
+        created.append(1)
+        return f"id-{len(created)}"
+
+    assert a.get_or_create("root", "bike", lambda: None, creator) == "id-1"
+    # Поиск в Drive ещё не видит новую папку, но создавать вторую нельзя
+    assert b.get_or_create("root", "bike", lambda: None, creator) == "id-1"
+    assert b.lookup("root", "bike", lambda: None) == "id-1"
+    assert created == [1]
+
+
+def test_saves_merge_entries_of_other_workers(caches):
+    a, b, path = caches
+
+    a.put("root", "one", "id-1")
+    b.put("root", "two", "id-2")
+    b.put_many("contracts", {"c1": "id-3"})
+    assert _saved(path) == {("root", "one"): "id-1", ("root", "two"): "id-2", ("contracts", "c1"): "id-3"}
+
+    a.forget("root", "two")
+    assert ("root", "two") not in _saved(path)
+    assert FolderCache(path).get("root", "one") == (True, "id-1")
@@ -0,0 +1,89 @@
+"""Хранилища FSM: SQLite, кэш поверх него и Redis на подделке fakeredis."""
+import asyncio
+
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage, CachedStorage
+
+KEY = StorageKey(bot_id=1, chat_id=100, user_id=100)
+OTHER = StorageKey(bot_id=1, chat_id=200, user_id=200)
+
+
+class Rent(StatesGroup):
+    contact = State()
+
+
+async def _round_trip(storage):
+    await storage.set_state(KEY, Rent.contact)
+    await storage.set_data(KEY, {"deposit": "паспорт", "photos": ["a", "b"]})
+    assert await storage.get_state(KEY) == Rent.contact.state
+    assert await storage.get_data(KEY) == {"deposit": "паспорт", "photos": ["a", "b"]}
+    assert await storage.get_state(OTHER) is None
+    assert await storage.get_data(OTHER) == {}
+
+    await storage.set_state(KEY, None)
+    assert await storage.get_state(KEY) is None
+    assert await storage.get_data(KEY) == {"deposit": "паспорт", "photos": ["a", "b"]}
+
+
+def test_sqlite_round_trip_survives_reopen(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def scenario():
+        storage = SQLiteStorage(path)
+        await _round_trip(storage)
+        await storage.set_state(KEY, Rent.contact)
+        await storage.close()
+
+        reopened = SQLiteStorage(path)
+        try:
+            return await reopened.get_state(KEY), await reopened.get_data(KEY)
+        finally:
+            await reopened.close()
+
+    state, data = asyncio.run(scenario())
+
+    assert state == Rent.contact.state
+    assert data == {"deposit": "паспорт", "photos": ["a", "b"]}
+
+
+def test_cache_returns_copies(tmp_path):
+    async def scenario():
+        storage = CachedStorage(SQLiteStorage(str(tmp_path / "fsm.sqlite3")), ttl=60)
+        await _round_trip(storage)
+
+        data = {"photos": ["a"]}
+        await storage.set_data(KEY, data)
+        data["photos"].append("changed after set")
+        read = await storage.get_data(KEY)
+        read["photos"].append("changed after get")
+        result = await storage.get_data(KEY)
+        stats = dict(storage.stats)
+        await storage.close()
+        return result, stats
+
+    data, stats = asyncio.run(scenario())
+
+    assert data == {"photos": ["a"]}
+    assert stats["hits"] > 0
+
+
+def test_redis_round_trip():
+    fakeredis = pytest.importorskip("fakeredis")
+    from aiogram.fsm.storage.redis import RedisStorage
+
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        storage = CachedStorage(RedisStorage(redis=redis), ttl=0)
+        await _round_trip(storage)
+        await storage.set_data(KEY, {"bike": 7})
+
+        # Другой экземпляр приложения видит запись сразу
+        other = CachedStorage(RedisStorage(redis=redis), ttl=0)
+        data = await other.get_data(KEY)
+        await storage.close()
+        return data
+
+    assert asyncio.run(scenario()) == {"bike": 7}
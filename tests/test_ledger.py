@@ -0,0 +1,142 @@
+"""
+Журнал выдач на подделке листа "Отчёты": сотни параллельных приращений
+дают точные дневные и месячные итоги, а повтор после потерянного ответа
+не добавляет сумму второй раз.
+"""
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+import fakes
+import quota
+import sheets
+from ledger import Ledger, KIND_RENTAL, KIND_EXTENSION
+from reports_index import ReportsIndex
+from google_clients import get_registry
+
+HEADERS = ["Дата", "Сумма выдачи", "Количество выдач", "Сумма за месяц в кассе", "Количество выдач за месяц"]
+DAYS = [datetime(2026, 3, 2, 12), datetime(2026, 3, 3, 12), datetime(2026, 3, 5, 12)]  # 4-е пропущено
+OPS = 400
+
+
+@pytest.fixture
+def sheet(tmp_path, monkeypatch):
+    injector = fakes.FaultInjector(latency_ms=1, error_rate=0.05, seed=1)
+    worksheet = fakes.FakeWorksheet(
+        sheets.REPORTS_WORKSHEET,
+        [HEADERS, ["01.03.2026", "1000", "1", "1000", "1"]],
+        injector
+    )
+    get_registry().install(spreadsheet=fakes.FakeSpreadsheet({sheets.REPORTS_WORKSHEET: worksheet}, injector))
+    monkeypatch.setattr(sheets, "_reports_index", ReportsIndex(str(tmp_path / "reports_index.json")))
+    # Без ограничений квоты и с короткими паузами повтора после 429
+    monkeypatch.setattr(quota, "_scheduler", quota.QuotaScheduler({key: 10 ** 9 for key in quota.BUDGETS}))
+    monkeypatch.setattr(quota, "MAX_BACKOFF", 0.01)
+    monkeypatch.setattr(quota, "MAX_RETRIES", 20)
+    yield worksheet
+    get_registry().reset()
+
+
+def _rows(worksheet):
+    return {row[0]: [int(v) for v in row[1:5]] for row in worksheet.get_all_values()[1:]}
+
+
+def _ledger(tmp_path, writer=sheets._apply_report_delta):
+    return Ledger(writer, path=str(tmp_path / "ledger.sqlite3"), lock_path=str(tmp_path / "reports.lock"))
+
+
+def test_parallel_increments_are_exact(sheet, tmp_path):
+    journal = _ledger(tmp_path)
+    rnd = random.Random(0)
+    ops = [(rnd.choice(DAYS), rnd.randint(1, 50) * 1000, rnd.random() < 0.7) for _ in range(OPS)]
+    stop = threading.Event()
+
+    def syncer():
+        # Синхронизация идёт одновременно с записью, как фоновая задача
+        while not stop.is_set():
+            try:
+                journal.sync()
+            except Exception:
+                pass
+
+    def record(op):
+        when, amount, is_rental = op
+        if is_rental:
+            journal.record(KIND_RENTAL, amount, 1, when)
+        else:
+            journal.record(KIND_EXTENSION, amount, 0, when)
+
+    syncers = [threading.Thread(target=syncer) for _ in range(3)]
+    for thread in syncers:
+        thread.start()
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        # Дни идут по порядку, как в жизни; внутри дня всё параллельно
+        for day in DAYS:
+            list(pool.map(record, [op for op in ops if op[0] == day]))
+    stop.set()
+    for thread in syncers:
+        thread.join()
+    while journal.pending():
+        journal.sync()
+
+    expected = {}
+    monthly_sum, monthly_count = 1000, 1
+    for day in DAYS:
+        day_sum = sum(amount for when, amount, _ in ops if when == day)
+        day_count = sum(1 for when, _, is_rental in ops if when == day and is_rental)
+        monthly_sum += day_sum
+        monthly_count += day_count
+        expected[day.strftime("%d.%m.%Y")] = [day_sum, day_count, monthly_sum, monthly_count]
+
+    rows = _rows(sheet)
+    assert rows.pop("01.03.2026") == [1000, 1, 1000, 1]
+    assert rows == expected
+    assert journal.stats["recorded"] == OPS
+
+
+@pytest.fixture
+def quiet_sheet(sheet, monkeypatch):
+    monkeypatch.setattr(sheet._injector, "error_rate", 0)
+    return sheet
+
+
+def test_lost_response_is_not_applied_twice(quiet_sheet, tmp_path):
+    calls = []
+
+    def writer(*args):
+        calls.append(args)
+        sheets._apply_report_delta(*args)
+        if len(calls) == 1:
+            # Google записал строку, но ответ до нас не дошёл
+            raise TimeoutError("read timeout")
+
+    journal = _ledger(tmp_path, writer)
+    journal.record(KIND_RENTAL, 1000, 1, DAYS[0])
+    with pytest.raises(TimeoutError):
+        journal.sync()
+    journal.record(KIND_EXTENSION, 500, 0, DAYS[0])
+    while journal.pending():
+        journal.sync()
+
+    assert _rows(quiet_sheet)["02.03.2026"] == [1500, 1, 2500, 2]
+    # Повтор отправил то же приращение, новое продление - отдельной записью
+    assert [args[1:3] for args in calls] == [(1000, 1), (1000, 1), (500, 0)]
+
+
+def test_crash_before_write_is_retried(quiet_sheet, tmp_path):
+    def writer(day, rental_sum, rental_count, expected, before_write):
+        # Процесс упал после сохранения ожидаемых итогов, но до записи
+        before_write(rental_sum, rental_count)
+        raise TimeoutError("killed")
+
+    _ledger(tmp_path, writer).record(KIND_RENTAL, 1000, 1, DAYS[0])
+    with pytest.raises(TimeoutError):
+        _ledger(tmp_path, writer).sync()
+
+    journal = _ledger(tmp_path)
+    assert journal.sync() == 1
+    assert not journal.pending()
+    assert _rows(quiet_sheet)["02.03.2026"] == [1000, 1, 2000, 2]
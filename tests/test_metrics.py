@@ -0,0 +1,36 @@
+"""Эндпоинт /metrics не должен ждать SQLite на цикле событий."""
+import asyncio
+import threading
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import metrics
+
+
+def test_blocking_collectors_run_in_a_thread(monkeypatch):
+    threads = {}
+
+    def collector(name):
+        def getter():
+            threads[name] = threading.current_thread()
+            return {"value": 1}
+        return getter
+
+    monkeypatch.setattr(metrics, "_collectors", [])
+    metrics.register_collector("sqlite", collector("sqlite"), blocking=True)
+    metrics.register_collector("memory", collector("memory"))
+
+    async def scrape():
+        app = web.Application()
+        app.router.add_get("/metrics", metrics.metrics_view)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get("/metrics")
+            return await response.text()
+
+    text = asyncio.run(scrape())
+
+    assert 'bot_sqlite{key="value"} 1' in text
+    assert 'bot_memory{key="value"} 1' in text
+    assert threads["sqlite"] is not threading.main_thread()
+    assert threads["memory"] is threading.main_thread()
@@ -0,0 +1,81 @@
+"""
+Аналитика листа "Отчёты": пересчёт месячных итогов, разбор ячеек и запись
+исправлений с --apply на подделке таблицы.
+"""
+import pytest
+
+import fakes
+import quota
+import sheets
+import report_analytics
+from google_clients import get_registry
+
+HEADERS = ["Дата", "Сумма выдачи", "Количество выдач", "Сумма за месяц в кассе", "Количество выдач за месяц"]
+BIKE_HEADERS = ["Марка", "Статус"]
+ROWS = [
+    HEADERS,
+    ["01.03.2026", "1 000", "1", "1000", "1"],
+    ["02.03.2026", "2 000 ₽", "2", "2500", "3"],  # месячная сумма должна быть 3000
+    ["04.03.2026", "500", "0", "3500", "3"],
+    ["01.04.2026", "700", "1", "700", "1"],
+]
+
+
+@pytest.fixture
+def install(monkeypatch):
+    monkeypatch.setattr(quota, "_scheduler", quota.QuotaScheduler({key: 10 ** 9 for key in quota.BUDGETS}))
+
+    def install(rows):
+        injector = fakes.FaultInjector()
+        reports = fakes.FakeWorksheet(sheets.REPORTS_WORKSHEET, rows, injector)
+        bikes = fakes.FakeWorksheet(sheets.BIKES_WORKSHEET, [BIKE_HEADERS, ["Honda", "в аренде"]], injector)
+        get_registry().install(spreadsheet=fakes.FakeSpreadsheet(
+            {sheets.REPORTS_WORKSHEET: reports, sheets.BIKES_WORKSHEET: bikes}, injector
+        ))
+        return reports
+
+    yield install
+    get_registry().reset()
+
+
+def test_monthly_totals_are_recomputed():
+    report = report_analytics.analyze_reports(ROWS)
+
+    assert report["total_sum"] == 4200
+    assert report["unparsed_cells"] == 0
+    assert report["gaps"][0] == {"after": "2026-03-02", "missing_days": 1}
+    assert [(c["row"], c["old"], c["new"]) for c in report["corrections"]] == [(3, 2500, 3000)]
+    assert report["by_month"][0] == {"month": "2026-03", "sum": 3500, "count": 3, "days": 3}
+
+
+@pytest.mark.parametrize("rows", [[], [HEADERS]])
+def test_empty_sheet(rows):
+    report = report_analytics.analyze_reports(rows)
+
+    assert report["rows"] == 0
+    assert report["corrections"] == []
+
+
+def test_decimal_comma_is_unparsed():
+    rows = [HEADERS, ["01.03.2026", "1 000,50", "1", "1000", "1"]]
+
+    assert report_analytics.analyze_reports(rows)["unparsed_cells"] == 1
+
+
+def test_apply_writes_corrections(install):
+    reports = install(ROWS)
+
+    report = report_analytics.run(apply=True)
+
+    assert report["applied"] == 1
+    assert reports.rows[2][3] == "3000"
+    assert report_analytics.analyze_reports(reports.get_all_values())["corrections"] == []
+
+
+def test_apply_refuses_unparsed_cells(install):
+    rows = [list(row) for row in ROWS]
+    rows[1][1] = "1 000,50"
+    reports = install(rows)
+
+    assert report_analytics.main(["--apply"]) == 1
+    assert reports.rows == rows
@@ -0,0 +1,138 @@
+"""
+Быстрый ответ на webhook через UpdateQueue: порядок апдейтов одного чата,
+параллельность разных чатов, отбрасывание повторов и 503 при полной очереди.
+"""
+import asyncio
+import functools
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+
+from update_queue import UpdateQueue, QueuedRequestHandler
+
+
+def _update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"},
+                    "text": str(update_id)},
+    }
+
+
+def _run(queue, scenario, on_message):
+    """Serve the webhook with a queue and run scenario(client, events)."""
+    async def main():
+        events = []
+        dispatcher = Dispatcher()
+
+        @dispatcher.message()
+        async def handle(message: Message):
+            await on_message(message, events)
+
+        bot = Bot("123456:TEST")
+        app = web.Application()
+        QueuedRequestHandler(dispatcher, bot, queue=queue).register(app, path="/webhook")
+        try:
+            async with TestClient(TestServer(app)) as client:
+                return await scenario(client, events)
+        finally:
+            await bot.session.close()
+
+    return asyncio.run(main())
+
+
+async def _slow(message, events):
+    events.append(("start", message.message_id))
+    # Первый апдейт каждого чата обрабатывается дольше второго
+    await asyncio.sleep(0.1 if message.message_id % 2 else 0.01)
+    events.append(("end", message.message_id))
+
+
+async def _post(client, *updates):
+    statuses = []
+    for update in updates:
+        response = await client.post("/webhook", json=update)
+        statuses.append(response.status)
+    return statuses
+
+
+async def _drain(queue):
+    while queue.depth():
+        await asyncio.sleep(0.01)
+
+
+def test_one_chat_in_order_two_chats_in_parallel():
+    queue = UpdateQueue(workers=4)
+
+    async def scenario(client, events):
+        statuses = await _post(client, _update(1, 100), _update(2, 100), _update(3, 200))
+        await _drain(queue)
+        return statuses, events
+
+    statuses, events = _run(queue, scenario, _slow)
+
+    assert statuses == [200, 200, 200]
+    # Чат 100: второй апдейт начинается только после первого
+    assert events.index(("end", 1)) < events.index(("start", 2))
+    # Чат 200 не ждёт медленный апдейт чата 100
+    assert events.index(("start", 3)) < events.index(("end", 1))
+
+
+def test_duplicate_update_is_dropped():
+    queue = UpdateQueue(workers=2)
+
+    async def scenario(client, events):
+        statuses = await _post(client, _update(1, 100), _update(1, 100))
+        await _drain(queue)
+        return statuses, events
+
+    statuses, events = _run(queue, scenario, _slow)
+
+    assert statuses == [200, 200]
+    assert events == [("start", 1), ("end", 1)]
+    assert queue.stats["duplicates"] == 1
+
+
+def test_duplicate_is_rechecked_after_waiting_for_space():
+    queue = UpdateQueue(workers=1, max_size=1)
+    release = asyncio.Event()
+
+    async def blocked(message, events):
+        events.append(message.message_id)
+        if message.message_id == 1:
+            await release.wait()
+
+    async def scenario(client, events):
+        await _post(client, _update(1, 100))
+        # Telegram повторяет апдейт 2, пока первая доставка ждёт места
+        retries = [asyncio.create_task(_post(client, _update(2, 200))) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        release.set()
+        statuses = [status for task in retries for status in await task]
+        await _drain(queue)
+        return statuses, events
+
+    statuses, events = _run(queue, scenario, blocked)
+
+    assert statuses == [200, 200]
+    assert events == [1, 2]
+    assert queue.stats["duplicates"] == 1
+
+
+def test_full_queue_answers_503_and_stop_drains():
+    queue = UpdateQueue(workers=1, max_size=2)
+    queue.put = functools.partial(UpdateQueue.put, queue, timeout=0.05)
+
+    async def scenario(client, events):
+        statuses = await _post(client, _update(1, 100), _update(3, 100), _update(5, 100))
+        await queue.stop()
+        return statuses, events
+
+    statuses, events = _run(queue, scenario, _slow)
+
+    assert statuses == [200, 200, 503]
+    assert queue.stats["rejected"] == 1
+    # stop() дождался обработки всего, что было в очереди
+    assert events == [("start", 1), ("end", 1), ("start", 3), ("end", 3)]
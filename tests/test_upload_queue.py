@@ -0,0 +1,46 @@
+"""Фоновая очередь загрузок: воркер переживает ошибки SQLite."""
+import asyncio
+import sqlite3
+
+import upload_queue
+from upload_queue import UploadQueue, KIND_PHOTO
+
+
+def test_worker_survives_database_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_queue, "POLL_INTERVAL", 0.01)
+
+    async def scenario():
+        done = asyncio.Event()
+        results = []
+
+        async def on_complete(bot, job, ok):
+            results.append((job["filename"], ok, job.get("result")))
+            done.set()
+
+        queue = UploadQueue(str(tmp_path / "uploads.sqlite3"), workers=1, on_complete=on_complete)
+        claim = queue._claim
+        failures = iter([sqlite3.OperationalError("database is locked")] * 2)
+
+        def flaky_claim():
+            error = next(failures, None)
+            if error is not None:
+                raise error
+            return claim()
+
+        async def upload(bot, job):
+            return "file-id"
+
+        monkeypatch.setattr(queue, "_claim", flaky_claim)
+        monkeypatch.setattr(queue, "_upload", upload)
+        await queue.enqueue(KIND_PHOTO, "f1", "u1", "photo.jpg", "contract")
+        queue.start(bot=None)
+        try:
+            await asyncio.wait_for(done.wait(), 5)
+        finally:
+            await queue.stop()
+        return queue, results
+
+    queue, results = asyncio.run(scenario())
+
+    assert results == [("photo.jpg", True, "file-id")]
+    assert queue.stats["worker_errors"] == 2
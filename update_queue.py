@@ -0,0 +1,218 @@
+"""
+Внутренняя очередь апдейтов для быстрого ответа на webhook.
+
+QueuedRequestHandler сразу отвечает Telegram 200 и кладёт апдейт в
+очередь. Апдейты одного чата обрабатываются строго по порядку, разные
+чаты - параллельно WEBHOOK_WORKERS воркерами. Повторные update_id
+отбрасываются. Очередь ограничена WEBHOOK_QUEUE_SIZE: когда она полна,
+запрос ждёт до WEBHOOK_QUEUE_PUT_TIMEOUT секунд и затем получает 503,
+после чего Telegram доставит апдейт повторно.
+
+Включается переменной WEBHOOK_FAST_ACK=1 и всегда при нескольких
+воркерах: тогда апдейты чужих чатов пересылаются воркеру-владельцу
+(workers.py).
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+import workers
+
+logger = logging.getLogger(__name__)
+
+FAST_ACK = os.getenv("WEBHOOK_FAST_ACK", "0") == "1" or workers.multi()
+WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+MAX_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+PUT_TIMEOUT = float(os.getenv("WEBHOOK_QUEUE_PUT_TIMEOUT", 5))
+DEDUP_SIZE = 10000
+STOP_TIMEOUT = 10
+
+
+def chat_key(update: Update):
+    """Chat (or user) the update belongs to; None if it has neither."""
+    try:
+        event = update.event
+    except Exception:  # неизвестный тип апдейта
+        return None
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else None
+
+
+class UpdateQueue:
+    def __init__(self, workers: int = WORKERS, max_size: int = MAX_SIZE, dedup_size: int = DEDUP_SIZE):
+        self._workers = workers
+        self._max_size = max_size
+        self._dedup_size = dedup_size
+        self._dispatcher: Dispatcher | None = None
+        self._data: dict = {}
+        # Ключ чата -> апдейты, ждущие обработки. Ключ есть в словаре, пока
+        # чат стоит в _ready или его апдейт обрабатывает воркер.
+        self._chats: dict = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._size = 0
+        self._space = asyncio.Condition()
+        self._seen: OrderedDict = OrderedDict()
+        self._tasks: list[asyncio.Task] = []
+        self.stats = {"enqueued": 0, "duplicates": 0, "rejected": 0, "processed": 0,
+                      "errors": 0, "max_wait": 0.0}
+
+    def depth(self) -> int:
+        return self._size
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, depth=self._size, chats=len(self._chats))
+
+    def _is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            self.stats["duplicates"] += 1
+            return True
+        return False
+
+    def _remember(self, update_id: int):
+        self._seen[update_id] = None
+        if len(self._seen) > self._dedup_size:
+            self._seen.popitem(last=False)
+
+    async def put(self, bot: Bot, update: Update, timeout: float = PUT_TIMEOUT) -> bool:
+        """Enqueue the update; False if the queue stayed full for timeout seconds."""
+        if self._is_duplicate(update.update_id):
+            return True
+        async with self._space:
+            try:
+                await asyncio.wait_for(self._space.wait_for(lambda: self._size < self._max_size), timeout)
+            except asyncio.TimeoutError:
+                self.stats["rejected"] += 1
+                logger.warning(f"Очередь апдейтов переполнена ({self._size}), апдейт {update.update_id} отклонён")
+                return False
+            # Пока ждали места, Telegram мог прислать тот же апдейт повторно
+            if self._is_duplicate(update.update_id):
+                return True
+            self._remember(update.update_id)
+            self._size += 1
+
+        self.stats["enqueued"] += 1
+        key = chat_key(update)
+        if key is None:
+            key = ("update", update.update_id)
+        item = (bot, update, time.monotonic())
+        pending = self._chats.get(key)
+        if pending is None:
+            self._chats[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            pending.append(item)
+        return True
+
+    async def _process(self, bot: Bot, update: Update):
+        try:
+            result = await self._dispatcher.feed_update(bot, update, **self._data)
+            if isinstance(result, TelegramMethod):
+                await self._dispatcher.silent_call_request(bot=bot, result=result)
+            self.stats["processed"] += 1
+        except Exception:
+            self.stats["errors"] += 1
+            logger.exception(f"Ошибка обработки апдейта {update.update_id}")
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            pending = self._chats[key]
+            bot, update, queued_at = pending.popleft()
+            self.stats["max_wait"] = max(self.stats["max_wait"], time.monotonic() - queued_at)
+            try:
+                await self._process(bot, update)
+            finally:
+                # Следующий апдейт чата - в конец очереди, чтобы не задерживать другие чаты
+                if pending:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                async with self._space:
+                    self._size -= 1
+                    self._space.notify_all()
+
+    def start(self, dispatcher: Dispatcher, **data):
+        self._dispatcher = dispatcher
+        self._data = data
+        for i in range(self._workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"update-worker-{i}"))
+        logger.info(f"Запущено воркеров апдейтов: {self._workers}, размер очереди: {self._max_size}")
+
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        """Let the workers drain the queue for up to timeout seconds, then cancel them."""
+        if not self._tasks:
+            return
+        try:
+            async with self._space:
+                await asyncio.wait_for(self._space.wait_for(lambda: self._size == 0), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Остановка с необработанными апдейтами: {self._size}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """SimpleRequestHandler that acks immediately and hands updates to UpdateQueue."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, queue: UpdateQueue | None = None, **kwargs):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.queue = queue or get_update_queue()
+        self.router = workers.Router()
+
+    def register(self, app: web.Application, /, path: str, **kwargs):
+        app.on_startup.append(self._start_queue)
+        super().register(app, path=path, **kwargs)
+
+    async def _start_queue(self, app: web.Application):
+        self.queue.start(self.dispatcher, **self.data)
+        if workers.multi():
+            await self.router.start(self._accept_forwarded)
+
+    async def _accept_forwarded(self, payload: dict) -> bool:
+        update = Update.model_validate(payload, context={"bot": self.bot})
+        return await self.queue.put(self.bot, update)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        payload = await request.json(loads=bot.session.json_loads)
+        update = Update.model_validate(payload, context={"bot": bot})
+        owner = workers.owner(chat_key(update))
+        if owner is not None and owner != workers.get_slot():
+            status = await self.router.forward(owner, payload)
+            if status == 200:
+                return web.json_response({}, dumps=bot.session.json_dumps)
+            if status is not None:
+                return web.Response(status=503, text="Update queue is full")
+            # Владелец недоступен (перезапускается) - обрабатываем сами
+        if not await self.queue.put(bot, update):
+            # Telegram повторит доставку позже
+            return web.Response(status=503, text="Update queue is full")
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self):
+        # Сначала дорабатываем очередь, потом закрываем сессию бота
+        await self.router.stop()
+        await self.queue.stop()
+        await super().close()
+
+
+_queue = None
+
+
+def get_update_queue() -> UpdateQueue:
+    global _queue
+    if _queue is None:
+        _queue = UpdateQueue()
+    return _queue
@@ -0,0 +1,305 @@
+"""
+Фоновая очередь загрузок фото договоров и видео в Google Drive.
+
+Задачи хранятся в SQLite, поэтому переживают перезапуск. Обработчик
+только ставит задачу в очередь и сразу отвечает пользователю; загрузку
+выполняет пул воркеров. Ошибки 429/5xx и сетевые сбои повторяются с
+экспоненциальной задержкой, повторная постановка того же файла
+(по file_unique_id) игнорируется. По завершении воркер редактирует
+сообщение пользователя. Запросы к SQLite могут ждать блокировку файла,
+поэтому выполняются в потоке, а не в event loop.
+
+Базу делят все воркеры gunicorn. Взятая задача закреплена за своим
+экземпляром очереди арендой на UPLOAD_LEASE секунд, которую тот
+продлевает, пока идёт загрузка. Задачу упавшего процесса другие воркеры
+забирают только после истечения аренды.
+"""
+import os
+import io
+import time
+import uuid
+import random
+import asyncio
+import sqlite3
+import logging
+import threading
+
+import quota
+import photos
+import google_async
+import video_stream
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", ".data")
+DB_PATH = os.path.join(DATA_DIR, "uploads.sqlite3")
+WORKERS = int(os.getenv("UPLOAD_WORKERS", 3))
+MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", 6))
+MAX_BACKOFF = 300
+POLL_INTERVAL = 1.0
+LEASE = float(os.getenv("UPLOAD_LEASE", 60))
+
+KIND_PHOTO = "photo"
+KIND_VIDEO = "video"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    file_unique_id TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
+    folder_name TEXT NOT NULL,
+    folder_id TEXT,
+    chat_id INTEGER,
+    message_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_at REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, next_at);
+"""
+# Колонки, добавленные после первой версии схемы
+_MIGRATIONS = {
+    "owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+    "lease_until": "ALTER TABLE jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0",
+}
+
+
+def is_retryable(e: Exception) -> bool:
+    status = quota.error_status(e)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(e, (ConnectionError, TimeoutError, OSError, asyncio.TimeoutError))
+
+
+class UploadQueue:
+    def __init__(self, path: str = DB_PATH, workers: int = WORKERS, on_complete=None):
+        """
+        on_complete(bot, job, ok) вызывается после успеха или окончательной
+        ошибки; по умолчанию редактирует сообщение пользователя.
+        """
+        self._path = path
+        self._workers = workers
+        self._on_complete = on_complete or self._edit_message
+        self._lock = threading.Lock()
+        # Владелец аренды: этот экземпляр очереди в этом процессе
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self.stats = {"enqueued": 0, "duplicates": 0, "done": 0, "failed": 0, "retries": 0,
+                      "worker_errors": 0}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, sql in _MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(sql)
+
+    # --- постановка ---
+
+    async def enqueue(self, kind: str, file_id: str, file_unique_id: str, filename: str, folder_name: str,
+                      chat_id: int | None = None, message_id: int | None = None,
+                      folder_id: str | None = None) -> bool:
+        """Queue an upload. Returns False if this file is already queued or uploaded."""
+        inserted = await asyncio.to_thread(
+            self._insert, kind, file_id, file_unique_id, filename, folder_name, chat_id, message_id, folder_id
+        )
+        if not inserted:
+            self.stats["duplicates"] += 1
+            logger.info(f"Файл {file_unique_id} уже в очереди загрузки")
+            return False
+        self.stats["enqueued"] += 1
+        self._wakeup.set()
+        return True
+
+    def _insert(self, kind, file_id, file_unique_id, filename, folder_name, chat_id, message_id, folder_id) -> bool:
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO jobs (kind, file_id, file_unique_id, filename, folder_name,"
+                " folder_id, chat_id, message_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                # Окончательно упавшую загрузку можно поставить заново
+                " ON CONFLICT (file_unique_id) DO UPDATE SET status = 'pending', attempts = 0,"
+                " next_at = 0, chat_id = excluded.chat_id, message_id = excluded.message_id"
+                " WHERE status = 'failed'",
+                (kind, file_id, file_unique_id, filename, folder_name,
+                 folder_id, chat_id, message_id, time.time())
+            )
+        return cur.rowcount > 0
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"
+            ).fetchone()[0]
+
+    # --- выборка и завершение ---
+
+    def _claim(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                # Задача с истёкшей арендой осталась от упавшего процесса
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE (status = 'pending' AND next_at <= ?)"
+                    " OR (status = 'running' AND lease_until < ?)"
+                    " ORDER BY next_at, id LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?, lease_until = ?"
+                        " WHERE id = ?",
+                        (self._owner, now + LEASE, row["id"])
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return dict(row) if row is not None else None
+
+    def _finish(self, job_id: int, status: str, result: str | None = None, error: str | None = None,
+                next_at: float = 0):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, next_at = ?, owner = NULL, lease_until = 0"
+                " WHERE id = ? AND owner = ?",
+                (status, result, error, next_at, job_id, self._owner)
+            )
+
+    def _renew(self, job_id: int):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time() + LEASE, job_id, self._owner)
+            )
+
+    def _release(self):
+        """Return this instance's running jobs to the queue, e.g. on shutdown."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'pending', owner = NULL, lease_until = 0"
+                " WHERE owner = ? AND status = 'running'",
+                (self._owner,)
+            )
+
+    async def _keep_lease(self, job_id: int):
+        while True:
+            await asyncio.sleep(LEASE / 3)
+            try:
+                await asyncio.to_thread(self._renew, job_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось продлить аренду задачи {job_id}: {e}")
+
+    async def _upload(self, bot, job: dict) -> str:
+        if job["kind"] == KIND_PHOTO:
+            fh = io.BytesIO()
+            await bot.download(job["file_id"], destination=fh)
+            data = await photos.compress_async(fh.getvalue())
+            folder_id = await google_async.upload_contract_photo(
+                data, job["filename"], job["folder_name"], job["folder_id"], raise_errors=True
+            )
+            return folder_id
+        if job["kind"] == KIND_VIDEO:
+            return await video_stream.stream_telegram_file(
+                bot, job["file_id"], job["filename"], job["folder_name"], raise_errors=True
+            )
+        raise ValueError(f"Неизвестный тип задачи: {job['kind']}")
+
+    async def _process(self, bot, job: dict):
+        lease = asyncio.create_task(self._keep_lease(job["id"]))
+        try:
+            with quota.lane(quota.UPLOAD):
+                result = await self._upload(bot, job)
+        except Exception as e:
+            attempts = job["attempts"] + 1
+            if is_retryable(e) and attempts < MAX_ATTEMPTS:
+                delay = min(2 ** attempts, MAX_BACKOFF) + random.uniform(0, 1)
+                self.stats["retries"] += 1
+                logger.warning(f"Загрузка {job['filename']} не удалась ({e}), повтор через {delay:.0f} с")
+                await asyncio.to_thread(self._finish, job["id"], "pending", error=str(e),
+                                        next_at=time.time() + delay)
+                return
+            self.stats["failed"] += 1
+            logger.error(f"Загрузка {job['filename']} окончательно не удалась: {e}")
+            await asyncio.to_thread(self._finish, job["id"], "failed", error=str(e))
+            await self._notify(bot, job, False)
+            return
+        finally:
+            lease.cancel()
+
+        self.stats["done"] += 1
+        await asyncio.to_thread(self._finish, job["id"], "done", result=result)
+        job["result"] = result
+        await self._notify(bot, job, True)
+
+    async def _notify(self, bot, job: dict, ok: bool):
+        try:
+            await self._on_complete(bot, job, ok)
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить о загрузке {job['filename']}: {e}")
+
+    @staticmethod
+    async def _edit_message(bot, job: dict, ok: bool):
+        if not job["chat_id"] or not job["message_id"]:
+            return
+        text = f"✅ {job['filename']} загружен" if ok else f"❌ Не удалось загрузить {job['filename']}"
+        await bot.edit_message_text(text=text, chat_id=job["chat_id"], message_id=job["message_id"])
+
+    # --- воркеры ---
+
+    async def _worker(self, bot):
+        while True:
+            # Сбрасываем до выборки, чтобы не потерять enqueue, пока поток читает базу
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self._claim)
+                if job is not None:
+                    await self._process(bot, job)
+                    continue
+            except Exception as e:
+                # Например "database is locked" при нескольких воркерах: задача
+                # останется в базе и вернётся в очередь по истечении аренды
+                self.stats["worker_errors"] += 1
+                logger.error(f"Ошибка воркера загрузки, продолжаем: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, bot):
+        for i in range(self._workers):
+            self._tasks.append(asyncio.create_task(self._worker(bot), name=f"upload-worker-{i}"))
+        logger.info(f"Запущено воркеров загрузки: {self._workers}, в очереди: {self.depth()}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # Прерванные задачи сразу возвращаем в очередь, не дожидаясь конца аренды
+        await asyncio.to_thread(self._release)
+        with self._lock:
+            self._db.close()
+
+
+_queue = None
+
+
+def get_upload_queue() -> UploadQueue:
+    global _queue
+    if _queue is None:
+        _queue = UploadQueue()
+    return _queue
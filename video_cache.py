@@ -0,0 +1,214 @@
+"""
+Кэш видео байков, скачанных из Google Drive.
+
+Ключ - (id файла в Drive, modifiedTime), поэтому заменённое видео
+скачивается заново. Небольшие файлы хранятся в памяти, крупные - на
+диске; оба уровня вытесняются по LRU. После первой отправки запоминается
+file_id в Telegram, и повторные запросы того же видео отправляются по
+ссылке без скачивания.
+"""
+import io
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", ".data")
+CACHE_DIR = os.path.join(DATA_DIR, "videos")
+MEMORY_ITEM_MAX = int(os.getenv("VIDEO_CACHE_MEMORY_ITEM_MB", 5)) * 1024 * 1024
+MEMORY_LIMIT = int(os.getenv("VIDEO_CACHE_MEMORY_MB", 50)) * 1024 * 1024
+DISK_LIMIT = int(os.getenv("VIDEO_CACHE_DISK_MB", 1024)) * 1024 * 1024
+
+
+def _key(meta: dict) -> str:
+    return f"{meta['id']}_{meta.get('modifiedTime', '')}".replace(":", "-")
+
+
+class VideoCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, memory_limit: int = MEMORY_LIMIT,
+                 memory_item_max: int = MEMORY_ITEM_MAX, disk_limit: int = DISK_LIMIT):
+        self._dir = cache_dir
+        self._memory_limit = memory_limit
+        self._memory_item_max = memory_item_max
+        self._disk_limit = disk_limit
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_size = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_size = 0
+        self._telegram_ids: dict[str, str] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "telegram_hits": 0, "downloads": 0}
+        os.makedirs(self._dir, exist_ok=True)
+        self._load()
+
+    def _ids_path(self) -> str:
+        return os.path.join(self._dir, "telegram_ids.json")
+
+    def _load(self):
+        files = []
+        for name in os.listdir(self._dir):
+            if name.endswith(".mp4"):
+                path = os.path.join(self._dir, name)
+                files.append((os.path.getmtime(path), name[:-4], os.path.getsize(path)))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_size += size
+        if os.path.exists(self._ids_path()):
+            try:
+                with open(self._ids_path(), "r", encoding="utf-8") as f:
+                    self._telegram_ids = json.load(f)
+            except ValueError:
+                self._telegram_ids = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._dir, f"{key}.mp4")
+
+    # --- LRU ---
+
+    def _evict(self):
+        # Только что добавленный элемент не вытесняем, даже если он больше лимита
+        while self._memory_size > self._memory_limit and len(self._memory) > 1:
+            _, data = self._memory.popitem(last=False)
+            self._memory_size -= len(data)
+        while self._disk_size > self._disk_limit and len(self._disk) > 1:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _cached(self, key: str):
+        """Return ("memory", bytes), ("disk", path) or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return "memory", self._memory[key]
+            if key in self._disk and os.path.exists(self._path(key)):
+                self._disk.move_to_end(key)
+                self.stats["disk_hits"] += 1
+                return "disk", self._path(key)
+            return None
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def fetch(self, meta: dict, downloader):
+        """
+        Ensure the file is cached and return ("memory", bytes) or ("disk", path).
+        downloader(fh) writes the Drive file into a binary file object.
+        """
+        key = _key(meta)
+        cached = self._cached(key)
+        if cached:
+            return cached
+        with self._key_lock(key):
+            cached = self._cached(key)
+            if cached:
+                return cached
+            self.stats["downloads"] += 1
+            size = int(meta.get("size") or 0)
+            if size and size <= self._memory_item_max:
+                fh = io.BytesIO()
+                downloader(fh)
+                data = fh.getvalue()
+                with self._lock:
+                    self._memory[key] = data
+                    self._memory_size += len(data)
+                    self._evict()
+                return "memory", data
+
+            # Крупные файлы пишем сразу на диск, не держа целиком в памяти
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.part"
+            with open(tmp_path, "wb") as fh:
+                downloader(fh)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk[key] = os.path.getsize(path)
+                self._disk_size += self._disk[key]
+                self._evict()
+            return "disk", path
+
+    def read(self, meta: dict, downloader) -> bytes:
+        kind, value = self.fetch(meta, downloader)
+        if kind == "memory":
+            return value
+        with open(value, "rb") as f:
+            return f.read()
+
+    # --- file_id в Telegram ---
+
+    def telegram_id(self, meta: dict) -> str | None:
+        with self._lock:
+            file_id = self._telegram_ids.get(_key(meta))
+            if file_id:
+                self.stats["telegram_hits"] += 1
+            return file_id
+
+    def remember_telegram_id(self, meta: dict, file_id: str | None):
+        with self._lock:
+            if file_id:
+                self._telegram_ids[_key(meta)] = file_id
+            else:
+                self._telegram_ids.pop(_key(meta), None)
+            tmp_path = f"{self._ids_path()}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._telegram_ids, f)
+            os.replace(tmp_path, self._ids_path())
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_video_cache() -> VideoCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = VideoCache()
+        return _cache
+
+
+async def send_latest_video(bot, chat_id: int, folder_name: str, caption: str | None = None) -> bool:
+    """
+    Send the newest video of a bike folder. Returns False if there is no video.
+    Already sent videos are re-sent by Telegram file_id without downloading.
+    """
+    from aiogram.types import BufferedInputFile, FSInputFile
+    from aiogram.exceptions import TelegramBadRequest
+
+    import drive
+    import google_async
+
+    meta = await google_async.run("drive", drive.get_latest_video_meta, folder_name)
+    if not meta:
+        return False
+
+    cache = get_video_cache()
+    file_id = cache.telegram_id(meta)
+    if file_id:
+        try:
+            await bot.send_video(chat_id, file_id, caption=caption)
+            return True
+        except TelegramBadRequest as e:
+            logger.warning(f"file_id видео устарел, отправляем файл заново: {e}")
+            cache.remember_telegram_id(meta, None)
+
+    kind, value = await google_async.run(
+        "drive_upload", cache.fetch, meta,
+        lambda fh: drive.download_file(meta["id"], fh)
+    )
+    name = meta.get("name") or "video.mp4"
+    video = BufferedInputFile(value, filename=name) if kind == "memory" else FSInputFile(value, filename=name)
+    message = await bot.send_video(chat_id, video, caption=caption)
+    sent = message.video or message.document
+    if sent:
+        cache.remember_telegram_id(meta, sent.file_id)
+    return True
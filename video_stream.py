@@ -0,0 +1,242 @@
+"""
+Потоковая загрузка файлов из Telegram в Google Drive.
+
+Файл скачивается из Telegram кусками и сразу отправляется в resumable
+сессию Drive. Между скачиванием и загрузкой стоит ограниченная очередь,
+поэтому в памяти одновременно лежат не больше STREAM_QUEUE_CHUNKS + 2
+чанков, а загрузка начинается, не дожидаясь конца скачивания. Упавший
+чанк дозагружается с подтверждённого сервером смещения.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+
+import drive
+import google_async
+import quota
+from google_clients import get_registry
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&fields=id"
+CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_MB", 8)) * 1024 * 1024
+QUEUE_CHUNKS = int(os.getenv("STREAM_QUEUE_CHUNKS", 2))
+MAX_RETRIES = 5
+DOWNLOAD_PIECE = 256 * 1024
+# (соединение, чтение) в секундах: зависший сокет не должен навсегда занять слот drive_upload
+REQUEST_TIMEOUT = (10, float(os.getenv("STREAM_TIMEOUT", 120)))
+
+stats = {
+    "uploads": 0,
+    "failed": 0,
+    "bytes": 0,
+    "seconds": 0.0,
+    "chunk_retries": 0,
+    "last_mb_per_s": 0.0,
+}
+
+
+class UploadSessionExpired(Exception):
+    pass
+
+
+class ResumableSession:
+    """Blocking client for one Drive resumable upload session."""
+
+    def __init__(self, url: str, http):
+        self.url = url
+        self.http = http
+
+    @classmethod
+    def start(cls, filename: str, folder_id: str, mimetype: str, total_size: int | None = None):
+        from google.auth.transport.requests import AuthorizedSession
+
+        http = AuthorizedSession(get_registry().credentials())
+        headers = {"X-Upload-Content-Type": mimetype}
+        if total_size:
+            headers["X-Upload-Content-Length"] = str(total_size)
+
+        def post():
+            resp = http.post(
+                UPLOAD_URL,
+                json={"name": filename, "parents": [folder_id]},
+                headers=headers,
+                timeout=REQUEST_TIMEOUT
+            )
+            resp.raise_for_status()
+            return resp
+
+        try:
+            resp = quota.call("drive", "write", post, priority=quota.UPLOAD)
+        except Exception:
+            http.close()
+            raise
+        return cls(resp.headers["Location"], http)
+
+    def close(self):
+        self.http.close()
+
+    def _committed(self, resp) -> int:
+        # Range: bytes=0-N - сервер принял N + 1 байт
+        value = resp.headers.get("Range")
+        if not value:
+            return 0
+        return int(value.rsplit("-", 1)[1]) + 1
+
+    def _status(self, total: str) -> int:
+        resp = self.http.put(self.url, headers={"Content-Range": f"bytes */{total}"}, timeout=REQUEST_TIMEOUT)
+        if resp.status_code in (200, 201):
+            return -1
+        if resp.status_code in (404, 410):
+            raise UploadSessionExpired(resp.text)
+        return self._committed(resp)
+
+    def put_chunk(self, data: bytes, offset: int, last: bool):
+        """
+        Send data starting at offset. Returns (next_offset, file_id);
+        file_id is set once the last chunk is committed.
+        """
+        attempt = 0
+        while True:
+            end = offset + len(data)
+            total = str(end) if last else "*"
+            if data:
+                content_range = f"bytes {offset}-{end - 1}/{total}"
+            else:
+                content_range = f"bytes */{total}"
+            quota.get_scheduler().acquire("drive", "write", priority=quota.UPLOAD)
+            try:
+                resp = self.http.put(self.url, data=data, headers={"Content-Range": content_range},
+                                     timeout=REQUEST_TIMEOUT)
+                status_code = resp.status_code
+            except Exception as e:
+                resp = None
+                status_code = None
+                logger.warning(f"Сбой отправки чанка {offset}-{end}: {e}")
+
+            if status_code in (200, 201):
+                return end, resp.json().get("id")
+            if status_code == 308:
+                committed = self._committed(resp)
+                if committed >= end:
+                    return end, None
+                # Сервер принял чанк частично - досылаем остаток
+                data = data[max(committed - offset, 0):]
+                offset = max(committed, offset)
+                continue
+            if status_code in (404, 410):
+                raise UploadSessionExpired(resp.text)
+            if status_code is not None and status_code < 500 and status_code != 429:
+                resp.raise_for_status()
+
+            attempt += 1
+            stats["chunk_retries"] += 1
+            if attempt > MAX_RETRIES:
+                raise RuntimeError(f"Чанк {offset}-{end} не загружен после {MAX_RETRIES} попыток")
+            time.sleep(min(2 ** attempt, 30) + random.random())
+            committed = self._status(total)
+            if committed == -1:
+                return end, None
+            data = data[max(committed - offset, 0):]
+            offset = max(committed, offset)
+
+
+async def stream_to_drive(chunks, filename: str, folder_name: str,
+                          mimetype: str = "video/mp4", total_size: int | None = None,
+                          raise_errors: bool = False) -> str | None:
+    """
+    Upload an async iterator of byte pieces into the bike folder.
+    Returns the Drive file id or None on error.
+    """
+    started = time.monotonic()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_CHUNKS)
+
+    async def produce():
+        buf = bytearray()
+        try:
+            async for piece in chunks:
+                buf.extend(piece)
+                while len(buf) >= CHUNK_SIZE:
+                    await queue.put(bytes(buf[:CHUNK_SIZE]))
+                    del buf[:CHUNK_SIZE]
+            if buf:
+                await queue.put(bytes(buf))
+            await queue.put(None)
+        except Exception as e:
+            # Передаём ошибку скачивания загрузчику, чтобы он не ждал вечно
+            await queue.put(e)
+
+    async def next_chunk():
+        item = await queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    producer = None
+    session = None
+    try:
+        # С raise_errors ошибка Drive (например, 429) уходит наверх как есть,
+        # чтобы очередь загрузок её повторила
+        folder_id = await google_async.get_or_create_folder_for_bike(folder_name, raise_errors)
+        if not folder_id:
+            raise RuntimeError(f"Папка {folder_name} недоступна")
+        try:
+            session = await google_async.run(
+                "drive_upload", ResumableSession.start, filename, folder_id, mimetype, total_size
+            )
+        except Exception as e:
+            if quota.error_status(e) != 404:
+                raise
+            # Папку удалили в Drive, а её id остался в кэше - находим или создаём заново
+            drive.forget_folder(folder_name)
+            folder_id = await google_async.get_or_create_folder_for_bike(folder_name, raise_errors)
+            if not folder_id:
+                raise RuntimeError(f"Папка {folder_name} недоступна")
+            session = await google_async.run(
+                "drive_upload", ResumableSession.start, filename, folder_id, mimetype, total_size
+            )
+
+        producer = asyncio.create_task(produce())
+        offset = 0
+        file_id = None
+        current = await next_chunk()
+        while True:
+            following = await next_chunk() if current is not None else None
+            last = following is None
+            offset, file_id = await google_async.run(
+                "drive_upload", session.put_chunk, current or b"", offset, last
+            )
+            if last:
+                break
+            current = following
+        await producer
+
+        elapsed = time.monotonic() - started
+        stats["uploads"] += 1
+        stats["bytes"] += offset
+        stats["seconds"] += elapsed
+        stats["last_mb_per_s"] = round(offset / 1024 / 1024 / elapsed, 2) if elapsed else 0.0
+        logger.info(f"Загружено {offset / 1024 / 1024:.1f} МБ за {elapsed:.1f} с ({stats['last_mb_per_s']} МБ/с)")
+        return file_id
+    except Exception as e:
+        stats["failed"] += 1
+        logging.error(f"Ошибка потоковой загрузки: {e}")
+        if raise_errors:
+            raise
+        return None
+    finally:
+        if producer is not None and not producer.done():
+            producer.cancel()
+        if session is not None:
+            session.close()
+
+
+async def stream_telegram_file(bot, file_id: str, filename: str, folder_name: str,
+                               mimetype: str = "video/mp4", raise_errors: bool = False) -> str | None:
+    """Pipe a Telegram file into Drive without buffering it whole."""
+    file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    chunks = bot.session.stream_content(url, chunk_size=DOWNLOAD_PIECE, timeout=300)
+    return await stream_to_drive(chunks, filename, folder_name, mimetype, file.file_size, raise_errors)
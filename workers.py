@@ -0,0 +1,179 @@
+"""
+Режим нескольких процессов под gunicorn (см. gunicorn.conf.py).
+
+- Слот: каждый воркер занимает файловую блокировку
+  DATA_DIR/workers/slot-N.lock, N от 0 до BOT_WORKERS-1. Номер слота
+  переживает перезапуск воркера и служит адресом для маршрутизации.
+- Лидер: webhook регистрирует только процесс, взявший
+  DATA_DIR/workers/leader.lock.
+- Маршрутизация: апдейты чата обрабатывает воркер chat_id % BOT_WORKERS.
+  Чужие апдейты пересылаются владельцу через unix-сокет, поэтому
+  сообщения одного чата идут по порядку, а кэш FSM не расходится.
+
+Блокировки и сокеты локальные, так что всё это работает в пределах
+одной машины. При BOT_WORKERS=1 модуль ничего не делает.
+"""
+import os
+import time
+import fcntl
+import asyncio
+import logging
+import threading
+
+from aiohttp import web, ClientError, ClientSession, ClientTimeout, UnixConnector
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", ".data")
+WORKERS_DIR = os.path.join(DATA_DIR, "workers")
+COUNT = max(1, int(os.getenv("BOT_WORKERS", 1)))
+SLOT_WAIT = 15  # старый воркер может ещё держать слот при перезапуске
+FORWARD_TIMEOUT = 5
+
+_lock = threading.Lock()
+_slot = None
+_slot_fd = None
+_leader = None
+_leader_fd = None
+
+
+def multi() -> bool:
+    return COUNT > 1
+
+
+def _try_lock(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    # Блокировка держится до выхода процесса
+    return fd
+
+
+def get_slot() -> int | None:
+    """This process's worker slot; None in single-process mode or if no slot is free."""
+    global _slot, _slot_fd
+    if not multi():
+        return None
+    with _lock:
+        if _slot_fd is not None:
+            return _slot
+        deadline = time.monotonic() + SLOT_WAIT
+        while True:
+            for n in range(COUNT):
+                fd = _try_lock(os.path.join(WORKERS_DIR, f"slot-{n}.lock"))
+                if fd is not None:
+                    _slot, _slot_fd = n, fd
+                    logger.info(f"Воркер {os.getpid()} занял слот {n} из {COUNT}")
+                    return _slot
+            if time.monotonic() >= deadline:
+                logger.warning(f"Воркер {os.getpid()}: свободных слотов нет, работаем без слота")
+                _slot_fd = -1
+                return None
+            time.sleep(0.5)
+
+
+def is_leader() -> bool:
+    """True for the single process that owns the webhook registration."""
+    global _leader, _leader_fd
+    if not multi():
+        return True
+    with _lock:
+        if _leader is None:
+            _leader_fd = _try_lock(os.path.join(WORKERS_DIR, "leader.lock"))
+            _leader = _leader_fd is not None
+            if _leader:
+                logger.info(f"Воркер {os.getpid()} - лидер")
+        return _leader
+
+
+class FileLock:
+    """Cross-process exclusive lock (flock) for read-modify-write on shared resources."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+def owner(key) -> int | None:
+    """Slot that must process updates of this chat; None if any worker may."""
+    if not multi() or not isinstance(key, int):
+        return None
+    return key % COUNT
+
+
+def socket_path(slot: int) -> str:
+    return os.path.join(WORKERS_DIR, f"worker-{slot}.sock")
+
+
+class Router:
+    """Internal unix-socket endpoint that receives updates forwarded by other workers."""
+
+    def __init__(self):
+        self._runner = None
+        self._sessions: dict[int, ClientSession] = {}
+        self.stats = {"forwarded": 0, "received": 0, "forward_errors": 0}
+
+    async def start(self, accept):
+        """accept(payload) -> bool enqueues a forwarded update locally."""
+        slot = get_slot()
+        if slot is None:
+            return
+
+        async def receive(request):
+            self.stats["received"] += 1
+            ok = await accept(await request.json())
+            return web.Response(status=200 if ok else 503)
+
+        app = web.Application()
+        app.router.add_post("/update", receive)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        path = socket_path(slot)
+        if os.path.exists(path):
+            os.unlink(path)
+        await web.UnixSite(self._runner, path).start()
+        logger.info(f"Приём апдейтов от других воркеров: {path}")
+
+    def _session(self, slot: int) -> ClientSession:
+        session = self._sessions.get(slot)
+        if session is None or session.closed:
+            session = self._sessions[slot] = ClientSession(
+                connector=UnixConnector(path=socket_path(slot)),
+                timeout=ClientTimeout(total=FORWARD_TIMEOUT),
+            )
+        return session
+
+    async def forward(self, slot: int, payload: dict) -> int | None:
+        """Hand the update to its owner; returns its HTTP status or None if it is unreachable."""
+        try:
+            async with self._session(slot).post("http://worker/update", json=payload) as resp:
+                status = resp.status
+        except (ClientError, OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"Воркер {slot} недоступен: {e}")
+            self.stats["forward_errors"] += 1
+            return None
+        self.stats["forwarded"] += 1
+        return status
+
+    async def stop(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None